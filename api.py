@@ -3,19 +3,23 @@ KREPS RAG System - Flask API Server
 Exposes HTTP endpoints for frontend integration
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from rag import QwenRAGSystem
 from werkzeug.utils import secure_filename
+import orjson
 import os
 import traceback
-from chunk import process_document
+from tempfile import SpooledTemporaryFile
+from pipeline import IngestionPipeline
 
 app = Flask(__name__)
 CORS(app)
 
 UPLOAD_FOLDER = './uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
+# Uploads up to this size stay in memory and never touch the disk before ingestion
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 rag_system = QwenRAGSystem(
@@ -25,6 +29,14 @@ rag_system = QwenRAGSystem(
     auto_cleanup=False
 )
 
+# Workers are created once at import and shared by every upload request
+ingestion_pipeline = IngestionPipeline(
+    embedding_module=rag_system.embedding_module,
+    vector_db=rag_system.vector_db,
+    chunk_size=500,
+    chunk_overlap=100
+)
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -39,7 +51,9 @@ def home():
             'GET /': 'API information',
             'GET /health': 'Health check',
             'POST /query': 'Answer questions',
+            'POST /query/stream': 'Answer questions as a server-sent event stream',
             'POST /upload': 'Upload documents',
+            'GET /upload/<job_id>': 'Ingestion job status',
             'GET /stats': 'Database statistics',
             'GET /documents': 'List documents'
         }
@@ -76,6 +90,30 @@ def query():
         return jsonify({'error': str(e), 'query': data.get('query', '') if data else ''}), 500
 
 
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    data = request.json
+
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+
+    user_query = data.get('query', '')
+
+    if not user_query or not user_query.strip():
+        return jsonify({'error': 'Query is required and cannot be empty'}), 400
+
+    def events():
+        # One SSE "data:" frame per token, then a final frame with the sources
+        for event in rag_system.answer_query_stream(user_query):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/upload', methods=['POST'])
 def upload():
     try:
@@ -87,41 +125,44 @@ def upload():
         if not files or files[0].filename == '':
             return jsonify({'error': 'No files selected'}), 400
 
-        saved_files = []
+        uploads = []
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(filepath)
-                saved_files.append(filename)
+                buffer = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+                file.save(buffer)
+                uploads.append((filename, buffer))
 
-        if not saved_files:
+        if not uploads:
             return jsonify({'error': 'No valid files uploaded. Only PDF, DOCX, and DOC files are allowed.'}), 400
 
-        all_chunks = []
-        for filename in saved_files:
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            chunks = process_document(filepath, chunk_size=500, chunk_overlap=100)
-            all_chunks.extend(chunks)
-
-        if all_chunks:
-            texts = [c.page_content for c in all_chunks]
-            embeddings = rag_system.embedding_module.embed_documents(texts)
-            rag_system.vector_db.store_chunks_with_embeddings(all_chunks, embeddings)
+        # Files are chunked straight from memory and saved to UPLOAD_FOLDER
+        # only once they have been ingested
+        saved_files = [filename for filename, _ in uploads]
+        job_id = ingestion_pipeline.submit_uploads(uploads, persist_dir=UPLOAD_FOLDER)
 
         return jsonify({
             'success': True,
-            'files_processed': len(saved_files),
-            'chunks_created': len(all_chunks),
+            'job_id': job_id,
+            'status_url': f'/upload/{job_id}',
+            'files_queued': len(saved_files),
             'files': saved_files,
-            'message': f'{len(saved_files)} document(s) uploaded and ingested successfully'
-        }), 200
+            'message': f'{len(saved_files)} document(s) uploaded and queued for ingestion'
+        }), 202
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/upload/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    job = ingestion_pipeline.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(job), 200
+
+
 @app.route('/stats', methods=['GET'])
 def stats():
     try:
@@ -154,4 +195,4 @@ def internal_error(error):
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    app.run(host='0.0.0.0', port=8000, debug=True, threaded=True)
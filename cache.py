@@ -0,0 +1,149 @@
+"""
+Semantic Cache Module - KREPS Project
+Two-level query cache: exact hits on normalized query text, then near-duplicate hits on query embeddings
+"""
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import numpy as np
+import xxhash
+
+
+class SemanticCache:
+    """
+    LRU cache keyed by query text (L1) and by query embedding (L2).
+
+    L1 matches queries that are identical after NFKC normalization,
+    lower-casing and whitespace collapsing. L2 matches queries whose
+    embedding has cosine similarity >= threshold with a cached query.
+    Entries expire after ttl_seconds. A max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int = 256, threshold: float = 0.985, ttl_seconds: float = 3600.0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size: Maximum number of cached queries (0 disables caching)
+            threshold: Minimum cosine similarity for an L2 hit. Keep it high: questions
+                differing in one decisive token ("in 2023" vs "in 2024") embed above 0.92
+            ttl_seconds: Lifetime of a cache entry
+        """
+        self.max_size = max(0, max_size)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (matrix slot, value, creation time)
+        self._entries: OrderedDict = OrderedDict()
+        self._slot_keys: List[Optional[str]] = [None] * self.max_size
+        self._free_slots = list(range(self.max_size - 1, -1, -1))
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(self.max_size, dtype=bool)
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        """Hash the normalized form of a query."""
+        normalized = " ".join(unicodedata.normalize("NFKC", query).lower().split())
+        return xxhash.xxh64(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, query: str) -> Optional[Any]:
+        """L1 lookup by normalized query text."""
+        key = self.make_key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(key, entry):
+                return None
+
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[1]
+
+    def get_similar(self, query_embedding) -> Optional[Any]:
+        """L2 lookup by cosine similarity of the query embedding."""
+        vector = self._normalize(query_embedding)
+        with self._lock:
+            if self._matrix is None or not self._valid.any():
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ vector
+            scores[~self._valid] = -np.inf
+            slot = int(np.argmax(scores))
+
+            key = self._slot_keys[slot]
+            entry = self._entries.get(key)
+            if scores[slot] < self.threshold or entry is None or self._expired(key, entry):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return entry[1]
+
+    def put(self, query: str, query_embedding, value: Any):
+        """Cache a value under both the query text and its embedding."""
+        if self.max_size == 0:
+            return
+
+        key = self.make_key(query)
+        vector = self._normalize(query_embedding)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if not self._free_slots:
+                self._remove(next(iter(self._entries)))
+
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            slot = self._free_slots.pop()
+            self._matrix[slot] = vector
+            self._valid[slot] = True
+            self._slot_keys[slot] = key
+            self._entries[key] = (slot, value, time.monotonic())
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        """Get hit/miss counters."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses
+            }
+
+    def _expired(self, key: str, entry: tuple) -> bool:
+        """Evict and report entries older than the TTL."""
+        if time.monotonic() - entry[2] <= self.ttl_seconds:
+            return False
+        self._remove(key)
+        return True
+
+    def _remove(self, key: str):
+        """Remove one entry and release its matrix slot."""
+        slot, _, _ = self._entries.pop(key)
+        self._valid[slot] = False
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
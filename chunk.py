@@ -1,37 +1,67 @@
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+import docx2txt
+import functools
 import os
-from pathlib import Path
+import threading
 from transformers import AutoTokenizer
 
+# File types find_documents picks up
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.doc'}
+
 # Load BGE-M3 tokenizer (used only for token counting)
 _tokenizer = None
+_tokenizer_loaded = False
+# HF fast tokenizers are not thread-safe ("Already borrowed"), and the
+# ingestion pipeline chunks several documents at once: loading and every
+# encode call go through this lock
+_tokenizer_lock = threading.Lock()
 
 def _get_tokenizer():
-    global _tokenizer
-    if _tokenizer is None:
-        try:
-            # Try offline / cached first (best for demo)
-            _tokenizer = AutoTokenizer.from_pretrained(
-                "BAAI/bge-m3",
-                local_files_only=True
-            )
-        except Exception:
-            # Fallback if cache exists or internet is available
-            _tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-m3")
-    return _tokenizer
-
-
-# This function is only for counting the number the tokens in a text
+    """Load the tokenizer once per process; None if it can't be loaded"""
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            try:
+                # Try offline / cached first (best for demo)
+                _tokenizer = AutoTokenizer.from_pretrained(
+                    "BAAI/bge-m3",
+                    local_files_only=True
+                )
+            except Exception:
+                try:
+                    # Fallback if cache exists or internet is available
+                    _tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-m3")
+                except Exception as e:
+                    print(f"Warning: Could not load tokenizer BAAI/bge-m3, estimating token counts instead: {e}")
+            _tokenizer_loaded = True
+        return _tokenizer
+
+
+# This function is only for counting the number the tokens in a text.
 def token_length(text: str) -> int:
     try:
-        tok = _get_tokenizer()
-        return len(tok.encode(text, add_special_tokens=False))
+        return _exact_token_length(text)
     except Exception:
-        # Safe fallback for prototype/demo
+        # Safe fallback for prototype/demo; not memoized, so a transient
+        # tokenizer error doesn't pin a wrong length to the text
         return max(len(text) // 4, len(text.split()))
 
 
+# The splitter measures the same pieces and separators over and over while
+# merging (~3.5 calls per distinct string on a typical PDF), so results are
+# memoized. Failures raise, and lru_cache does not store exceptions.
+@functools.lru_cache(maxsize=8192)
+def _exact_token_length(text: str) -> int:
+    tok = _get_tokenizer()
+    if tok is None:
+        raise RuntimeError("tokenizer unavailable")
+    with _tokenizer_lock:
+        return len(tok.encode(text, add_special_tokens=False))
+
+
 
 def process_document(file_path, chunk_size=500, chunk_overlap=100):
     """
@@ -58,66 +88,118 @@ def process_document(file_path, chunk_size=500, chunk_overlap=100):
     # Load the document
     documents = loader.load()
 
-    # Create text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
+    return _split_documents(documents, os.path.basename(file_path), chunk_size, chunk_overlap)
+
+
+def process_stream(stream, filename, chunk_size=500, chunk_overlap=100):
+    """
+    Load and chunk a PDF or DOCX file from an open binary stream
+
+    Args:
+        stream: Seekable binary file-like object with the document bytes
+        filename: Original file name (used for the file type and metadata)
+        chunk_size: Maximum size of each chunk in characters
+        chunk_overlap: Number of characters to overlap between chunks
+
+    Returns:
+        List of document chunks with metadata
+    """
+    file_extension = os.path.splitext(filename)[1].lower()
+    stream.seek(0)
+
+    # Same per-page / per-file layout the path-based loaders produce
+    if file_extension == '.pdf':
+        reader = PdfReader(stream)
+        documents = [
+            Document(page_content=page.extract_text(), metadata={'source': filename, 'page': i})
+            for i, page in enumerate(reader.pages)
+        ]
+    elif file_extension in ['.docx', '.doc']:
+        documents = [Document(page_content=docx2txt.process(stream), metadata={'source': filename})]
+    else:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+    return _split_documents(documents, filename, chunk_size, chunk_overlap)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_text_splitter(chunk_size, chunk_overlap):
+    """Create the text splitter once per chunk configuration"""
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=token_length,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
 
+
+def _split_documents(documents, filename, chunk_size, chunk_overlap):
+    """Split loaded documents into chunks tagged with their file name"""
     # Split into chunks
-    chunks = text_splitter.split_documents(documents)
+    chunks = _get_text_splitter(chunk_size, chunk_overlap).split_documents(documents)
 
-    # Add filename to metadata
-    filename = os.path.basename(file_path)
-    for chunk in chunks:
+    # Add filename and the chunk's position in the whole document to metadata
+    for i, chunk in enumerate(chunks):
         chunk.metadata['filename'] = filename
+        chunk.metadata['chunk_index'] = i
 
     return chunks
 
 
+def find_documents(directory_path):
+    """
+    List the PDF and DOCX files in a directory
+
+    Args:
+        directory_path: Path to directory containing documents
+
+    Returns:
+        Paths of the supported files, sorted by name
+    """
+    # Single pass over the directory, filtering on the extension
+    with os.scandir(directory_path) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+        )
+
+
 def process_directory(directory_path, chunk_size=500, chunk_overlap=100):
     """
     Process all PDFs and DOCX files in a directory
 
+    Chunks are yielded one file at a time, so only a single document's chunks
+    are held in memory; wrap the call in list() to collect everything.
+
     Args:
         directory_path: Path to directory containing documents
         chunk_size: Maximum size of each chunk in characters
         chunk_overlap: Number of characters to overlap between chunks
 
-    Returns:
-        List of all document chunks from all files
+    Yields:
+        Document chunks from all files
     """
-    all_chunks = []
-
-    # Get all PDF and DOCX files
-    directory = Path(directory_path)
-    file_patterns = ['*.pdf', '*.docx', '*.doc']
-
-    files = []
-    for pattern in file_patterns:
-        files.extend(directory.glob(pattern))
+    files = find_documents(directory_path)
 
     print(f"Found {len(files)} documents to process")
 
     # Process each file
     for file_path in files:
-        print(f"Processing {file_path.name}...")
+        print(f"Processing {os.path.basename(file_path)}...")
 
         try:
             chunks = process_document(
-                str(file_path),
+                file_path,
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap
             )
-            all_chunks.extend(chunks)
             print(f"  ✓ Created {len(chunks)} chunks")
 
         except Exception as e:
-            print(f"  ✗ Error processing {file_path.name}: {e}")
+            print(f"  ✗ Error processing {os.path.basename(file_path)}: {e}")
+            continue
 
-    return all_chunks
+        yield from chunks
 
 
 def get_chunk_statistics(chunks):
@@ -158,16 +240,20 @@ def save_chunks_to_file(chunks, output_file="chunks_output.txt"):
         chunks: List of document chunks
         output_file: Path to output file
     """
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for i, chunk in enumerate(chunks):
-            f.write(f"{'=' * 80}\n")
-            f.write(f"CHUNK {i + 1}\n")
-            f.write(f"Source: {chunk.metadata.get('filename', 'unknown')}\n")
-            f.write(f"Page: {chunk.metadata.get('page', 'N/A')}\n")
-            f.write(f"Length: {len(chunk.page_content)} characters\n")
-            f.write(f"{'=' * 80}\n")
-            f.write(chunk.page_content)
-            f.write(f"\n\n")
+    rule = '=' * 80
+
+    # One string per chunk, written through a 1 MiB buffer
+    with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.writelines(
+            f"{rule}\n"
+            f"CHUNK {i + 1}\n"
+            f"Source: {chunk.metadata.get('filename', 'unknown')}\n"
+            f"Page: {chunk.metadata.get('page', 'N/A')}\n"
+            f"Length: {len(chunk.page_content)} characters\n"
+            f"{rule}\n"
+            f"{chunk.page_content}\n\n"
+            for i, chunk in enumerate(chunks)
+        )
 
     print(f"Chunks saved to {output_file}")
 
@@ -183,7 +269,7 @@ if __name__ == "__main__":
     # Process all documents in a directory
     print("Example 2: Process directory of documents")
     print("-" * 80)
-    all_chunks = process_directory("./documents", chunk_size=500, chunk_overlap=100)
+    all_chunks = list(process_directory("./documents", chunk_size=500, chunk_overlap=100))
 
     # Get statistics
     stats = get_chunk_statistics(all_chunks)
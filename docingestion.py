@@ -4,13 +4,43 @@ from typing import List, Optional
 from dataclasses import dataclass
 from pathlib import Path
 import time
-import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-import PyPDF2
+import numpy as np
+import pypdfium2 as pdfium
+import xxhash
 from langdetect import detect, DetectorFactory
 
 DetectorFactory.seed = 0
 
+# Control characters other than tab, newline and carriage return
+_CTRL_TABLE = dict.fromkeys(i for i in range(32) if chr(i) not in '\n\t\r')
+_WS_RE = re.compile(r'(?P<trailing>[^\S\n]+(?=\n))|(?P<breaks>\n{3,})|(?P<spaces> {2,})')
+_WS_REPLACEMENTS = {'trailing': '', 'breaks': '\n\n', 'spaces': ' '}
+
+# Smaller PDFs are extracted in-process; starting workers would cost more than it saves
+_PARALLEL_MIN_PAGES = 32
+
+
+def _extract_page_range(args: tuple) -> List[str]:
+    """Extract the text of pages [start, stop) in a worker process."""
+    file_path, start, stop = args
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return [_extract_page(pdf, i) for i in range(start, stop)]
+    finally:
+        pdf.close()
+
+
+def _extract_page(pdf: pdfium.PdfDocument, index: int) -> str:
+    page = pdf[index]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
 @dataclass
 class Document:
     doc_id: str
@@ -94,27 +124,38 @@ class DocumentIngestion:
         )
 
     def _extract_text_from_pdf(self, file_path: str) -> str:
-        text_content = ""
-        with open(file_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            for page in pdf_reader.pages:
-                text_content += page.extract_text() + "\n"
-        return text_content
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            page_count = len(pdf)
+            workers = min(os.cpu_count() or 1, page_count // _PARALLEL_MIN_PAGES)
+            if workers <= 1:
+                pages = [_extract_page(pdf, i) for i in range(page_count)]
+                return "\n".join(pages) + "\n"
+        finally:
+            pdf.close()
+
+        # PDFium is not thread-safe, so large documents are split into
+        # contiguous page ranges across processes, each with its own handle
+        bounds = [page_count * i // workers for i in range(workers + 1)]
+        ranges = [(file_path, bounds[i], bounds[i + 1]) for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pages = [text for chunk in executor.map(_extract_page_range, ranges) for text in chunk]
+        return "\n".join(pages) + "\n"
 
     def _process_docx(self, file_path: str, file_name: str) -> Optional[Document]:
         #from docx import Document as DocxDocument
         #
-        # text_content = ""
         # doc_obj = DocxDocument(file_path)
         #
-        # for paragraph in doc_obj.paragraphs:
-        #     text_content += paragraph.text + "\n"
+        # # Collect the pieces and join once; += on a growing string copies it every time
+        # parts = [paragraph.text + "\n" for paragraph in doc_obj.paragraphs]
         #
         # for table in doc_obj.tables:
         #     for row in table.rows:
-        #         for cell in row.cells:
-        #             text_content += cell.text + " "
-        #     text_content += "\n"
+        #         parts.extend(cell.text + " " for cell in row.cells)
+        #     parts.append("\n")
+        #
+        # text_content = "".join(parts)
         #
         # if not text_content.strip():
         #     return None
@@ -171,13 +212,9 @@ class DocumentIngestion:
         return None
 
     def _clean_text(self, text: str) -> str:
-        text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\t\r')
-        text = re.sub(r'\n\n\n+', '\n\n', text)
-        text = re.sub(r' {2,}', ' ', text)
-        lines = [line.rstrip() for line in text.split('\n')]
-        text = '\n'.join(lines)
-        text = text.strip()
-        return text
+        text = text.translate(_CTRL_TABLE)
+        text = _WS_RE.sub(lambda match: _WS_REPLACEMENTS[match.lastgroup], text)
+        return text.strip()
 
     def _detect_language(self, text: str) -> str:
         try:
@@ -185,18 +222,28 @@ class DocumentIngestion:
                 return 'unknown'
 
             sample_text = text[:5000] if len(text) > 5000 else text
-            detected_lang = detect(sample_text)
 
-            korean_count = len(re.findall(r'[\uac00-\ud7af]', text))
-            english_count = len(re.findall(r'[a-zA-Z]', text))
-            total_chars = len(re.findall(r'[\uac00-\ud7af]|[a-zA-Z]', text))
+            # The script ratio is taken from the same sample as detect(),
+            # counted over its code points in one vectorized pass
+            codes = np.frombuffer(sample_text.encode('utf-32-le'), dtype=np.uint32)
+            korean_count = int(np.count_nonzero((codes >= 0xAC00) & (codes <= 0xD7AF)))
+            folded = codes | 0x20  # maps A-Z onto a-z and nothing else onto a-z
+            english_count = int(np.count_nonzero((folded >= 0x61) & (folded <= 0x7A)))
+            total_chars = korean_count + english_count
 
+            # Resolve clear-cut samples from the script ratio alone and only
+            # run langdetect's n-gram model on ambiguous text
             if total_chars > 0:
                 korean_ratio = korean_count / total_chars
                 english_ratio = english_count / total_chars
                 if korean_ratio > 0.05 and english_ratio > 0.05:
                     return 'mixed'
+                if korean_ratio >= 0.9:
+                    return 'ko'
+                if english_ratio >= 0.9:
+                    return 'en'
 
+            detected_lang = detect(sample_text)
             if detected_lang == 'ko':
                 return 'ko'
             elif detected_lang == 'en':
@@ -209,7 +256,7 @@ class DocumentIngestion:
     def _generate_doc_id(self, file_name: str) -> str:
         timestamp = int(time.time() * 1000)
         hash_input = f"{file_name}_{timestamp}".encode('utf-8')
-        hash_value = hashlib.md5(hash_input).hexdigest()[:12]
+        hash_value = xxhash.xxh64(hash_input).hexdigest()[:12]
         file_base = Path(file_name).stem
         return f"{file_base}_{hash_value}"
 
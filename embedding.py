@@ -4,54 +4,320 @@ Generates embeddings using BGE-M3 model
 """
 
 from FlagEmbedding import BGEM3FlagModel
-from typing import List, Union
+from typing import Dict, List, Optional, Protocol, Tuple, Union
+import functools
 import numpy as np
+import os
+import threading
+
+
+class EmbeddingBackend(Protocol):
+    """
+    Encoder interface VectorEmbeddingModule runs on: BGEM3FlagModel (PyTorch)
+    or OnnxBGEM3Encoder (ONNX Runtime). encode returns {"dense_vecs": ndarray}.
+    """
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, max_length: int = 512, **kwargs) -> dict:
+        ...
+
+
+class OnnxBGEM3Encoder:
+    """
+    Dense BGE-M3 encoder running an int8-quantized ONNX export with ONNX Runtime.
+    Mirrors the dense part of BGEM3FlagModel.encode so it can stand in for it on CPU.
+    """
+
+    # Tried in this order; OpenVINO only when onnxruntime-openvino is installed
+    DEFAULT_PROVIDERS = ("OpenVINOExecutionProvider", "CPUExecutionProvider")
+
+    def __init__(
+            self,
+            model_path: str,
+            tokenizer_name: str = "BAAI/bge-m3",
+            providers: Optional[List[str]] = None,
+            fixed_shapes: Optional[List[Tuple[int, int]]] = None
+    ):
+        """
+        Load the ONNX session and the matching tokenizer.
+
+        Args:
+            model_path: Path to the quantized .onnx file (see quantize_onnx_model)
+            tokenizer_name: HuggingFace tokenizer matching the exported model
+            providers: ONNX Runtime execution providers in order of preference.
+                Defaults to the comma-separated KREPS_EMBED_ONNX_PROVIDERS
+                environment variable, else DEFAULT_PROVIDERS. Providers this
+                onnxruntime build lacks are skipped.
+            fixed_shapes: (batch size, sequence length) pairs to build extra
+                shape-specialized sessions for, e.g. [(32, 512), (1, 128)] for
+                ingestion batches and single queries. Defaults to the
+                KREPS_EMBED_ONNX_SHAPES environment variable ("32x512,1x128"),
+                else none. Batches that fit a shape are padded to it; the rest
+                use the dynamic-shape session.
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if providers is None:
+            configured = os.environ.get("KREPS_EMBED_ONNX_PROVIDERS")
+            providers = configured.split(",") if configured else list(self.DEFAULT_PROVIDERS)
+        available = set(ort.get_available_providers())
+        providers = [p.strip() for p in providers if p.strip() in available] or ["CPUExecutionProvider"]
+
+        if fixed_shapes is None:
+            configured = os.environ.get("KREPS_EMBED_ONNX_SHAPES")
+            fixed_shapes = [
+                tuple(int(n) for n in shape.lower().split("x"))
+                for shape in configured.split(",")
+            ] if configured else []
+
+        def session_options():
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.intra_op_num_threads = os.cpu_count() or 1
+            return options
+
+        self.session = ort.InferenceSession(model_path, sess_options=session_options(), providers=providers)
+        self.providers = self.session.get_providers()
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+        # Sessions with the symbolic batch / sequence dimensions pinned, so ONNX
+        # Runtime can fold shape computations and plan memory once; smallest first
+        self.fixed_sessions = []
+        dims = self.session.get_inputs()[0].shape
+        if fixed_shapes and len(dims) == 2 and all(isinstance(dim, str) for dim in dims):
+            for batch, seq in sorted(fixed_shapes, key=lambda shape: shape[0] * shape[1]):
+                options = session_options()
+                options.add_free_dimension_override_by_name(dims[0], batch)
+                options.add_free_dimension_override_by_name(dims[1], seq)
+                session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+                self.fixed_sessions.append((batch, seq, session))
+
+    def encode(
+            self,
+            sentences: Union[str, List[str]],
+            batch_size: int = 32,
+            max_length: int = 512,
+            return_dense: bool = True,
+            **kwargs
+    ) -> dict:
+        """
+        Encode text into L2-normalized CLS vectors, returned as {"dense_vecs": ndarray}.
+        Only the dense output is exported; sparse / ColBERT options are ignored.
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=max_length,
+                return_tensors="np"
+            )
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names if name in inputs}
+            rows = len(feed[self.input_names[0]])
+            hidden = self._run(feed)
+
+            # BGE-M3 dense vectors are the normalized [CLS] hidden state
+            cls = hidden[:rows, 0].astype(np.float32)
+            batches.append(cls / np.linalg.norm(cls, axis=1, keepdims=True))
+
+        dense = np.concatenate(batches) if batches else np.zeros((0, 1024), dtype=np.float32)
+        return {"dense_vecs": dense[0] if single else dense}
+
+    def _run(self, feed: Dict[str, np.ndarray]) -> np.ndarray:
+        """Run the smallest fixed-shape session the batch fits in, else the dynamic one."""
+        rows, length = feed[self.input_names[0]].shape
+        for batch, seq, session in self.fixed_sessions:
+            if rows <= batch and length <= seq:
+                break
+        else:
+            return self.session.run(None, feed)[0]
+
+        padded = {}
+        for name, values in feed.items():
+            # Padding positions are masked out; padding rows repeat the first
+            # row so they stay well-formed and are dropped afterwards
+            fill = self.tokenizer.pad_token_id if name == "input_ids" else 0
+            array = np.full((batch, seq), fill, dtype=np.int64)
+            array[:rows, :length] = values
+            array[rows:, :length] = values[0]
+            padded[name] = array
+        return session.run(None, padded)[0]
+
+
+def quantize_onnx_model(onnx_path: str, output_path: str):
+    """
+    Quantize an exported BGE-M3 ONNX model to int8 for the CPU path.
+
+    Export the model first with:
+        optimum-cli export onnx --model BAAI/bge-m3 --task feature-extraction bge-m3-onnx/
+
+    On AVX-512 VNNI hosts, optimum can produce an equivalent model tuned for them:
+        optimum-cli onnxruntime quantize --avx512_vnni --onnx_model bge-m3-onnx/ -o bge-m3-int8/
+
+    Args:
+        onnx_path: Path to the exported FP32 model.onnx
+        output_path: Where to write the int8 model
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # BGE-M3 is larger than 2GB in FP32, so the export uses external data
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    print(f"Quantized model written to: {output_path}")
+
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model(model_name: str, use_fp16: bool, onnx_model_path: Optional[str]) -> EmbeddingBackend:
+    """
+    Load an encoder once per configuration.
+
+    Repeated VectorEmbeddingModule construction (tests, re-imports) reuses the
+    weights, and a process that loads them before forking (gunicorn
+    preload_app) shares them copy-on-write with its workers.
+    """
+    print(f"Loading embedding model: {model_name}")
+    if onnx_model_path and not _cuda_available():
+        # CPU-only host: int8 ONNX Runtime kernels (VNNI / ARM dot-product)
+        encoder = OnnxBGEM3Encoder(onnx_model_path, tokenizer_name=model_name)
+        print(f"Using ONNX Runtime model: {onnx_model_path} ({', '.join(encoder.providers)})")
+        return encoder
+
+    # FP16 only takes effect on GPU; FlagEmbedding keeps FP32 on CPU.
+    # Vectors come back normalized and as float32 on the host either way.
+    return BGEM3FlagModel(model_name, use_fp16=use_fp16, normalize_embeddings=True)
+
+
+def _resolve_options(use_fp16: Optional[bool], onnx_model_path: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """Fill in unset encoder options from the environment."""
+    if use_fp16 is None:
+        use_fp16 = os.environ.get("KREPS_EMBED_FP16", "1") == "1"
+    if onnx_model_path is None:
+        onnx_model_path = os.environ.get("KREPS_EMBED_ONNX")
+    return use_fp16, onnx_model_path
+
+
+# One VectorEmbeddingModule per configuration and process
+_instances: Dict[tuple, "VectorEmbeddingModule"] = {}
+_instances_lock = threading.Lock()
 
 
 class VectorEmbeddingModule:
     """
     Handles conversion of text to vector embeddings using BGE-M3.
     This module ONLY does embedding - storage is handled by vdb.py
+
+    Constructing it again with the same configuration returns the existing
+    instance, so QwenRAGSystem, the ingestion pipeline and the CLI share one
+    encoder. Calls into the encoder are serialized by a lock: the HuggingFace
+    fast tokenizer raises "Already borrowed" when used from several threads at once.
     """
 
-    def __init__(self, model_name: str = "BAAI/bge-m3"):
+    def __new__(
+            cls,
+            model_name: str = "BAAI/bge-m3",
+            use_fp16: Optional[bool] = None,
+            onnx_model_path: Optional[str] = None
+    ):
+        key = (cls, model_name, *_resolve_options(use_fp16, onnx_model_path))
+        with _instances_lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._initialized = False
+                _instances[key] = instance
+        return instance
+
+    def __init__(
+            self,
+            model_name: str = "BAAI/bge-m3",
+            use_fp16: Optional[bool] = None,
+            onnx_model_path: Optional[str] = None
+    ):
         """
         Initialize the BGE-M3 embedding model.
 
         Args:
             model_name: HuggingFace model name for embeddings
+            use_fp16: Run the encoder in half precision. Defaults to the
+                KREPS_EMBED_FP16 environment variable (on unless set to "0")
+            onnx_model_path: Int8 ONNX export used instead of PyTorch when no
+                GPU is available. Defaults to the KREPS_EMBED_ONNX environment variable
         """
-        print(f"Loading embedding model: {model_name}")
-        self.model = BGEM3FlagModel(model_name, use_fp16=False)
+        # Shared instance that was already set up
+        if self._initialized:
+            return
+
+        use_fp16, onnx_model_path = _resolve_options(use_fp16, onnx_model_path)
+
+        self.model = _load_model(model_name, use_fp16, onnx_model_path)
+        self._encode_lock = threading.Lock()
+        self.use_fp16 = use_fp16 and not isinstance(self.model, OnnxBGEM3Encoder)
         self.embedding_dim = 1024  # BGE-M3 uses 1024 dimensions
         print(f"VectorEmbeddingModule initialized")
         print(f"Embedding dimension: {self.embedding_dim}")
+        print(f"FP16: {self.use_fp16}")
+        self._initialized = True
 
-    def embed_text(self, text):
-        results = self.model.encode(
-            text,
-            batch_size=32,
-            max_length=512
-        )
+    def embed_text(self, text, batch_size: int = 32) -> np.ndarray:
+        """
+        Embed one text or a list of texts.
 
-        # BGEM3FlagModel.encode may return a dict
-        if isinstance(results, dict):
-            results = results.get("dense_vecs")
+        Args:
+            text: A string or a list of strings
+            batch_size: Number of texts tokenized and run through the model per forward pass
 
-        if results is None:
+        Returns:
+            float32 array of shape (1024,) for a string or (N, 1024) for a list
+        """
+        with self._encode_lock:
+            results = self.model.encode(
+                text,
+                batch_size=batch_size,
+                max_length=512,
+                return_dense=True,
+                return_sparse=False,
+                return_colbert_vecs=False
+            )
+
+        dense_vecs = results.get("dense_vecs")
+        if dense_vecs is None:
             raise ValueError("Embedding model returned no dense_vecs output")
 
-        return results.tolist() if hasattr(results, "tolist") else results
+        return np.ascontiguousarray(dense_vecs, dtype=np.float32)
 
-    def embed_documents(self, documents: List[str]) -> List[List[float]]:
+    def embed_documents(self, documents: List[str], batch_size: int = 32) -> np.ndarray:
         """
-        Convenience method to embed multiple documents and return as list.
+        Convenience method to embed multiple documents.
 
         Args:
             documents: List of document text strings
+            batch_size: Number of documents per forward pass; larger batches
+                keep a GPU busier, smaller ones bound peak memory
 
         Returns:
-            List of embeddings (each embedding is a list of 1024 floats)
+            float32 array of shape (N, 1024), one row per document
         """
-        embeddings = self.embed_text(documents)
+        if not documents:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+
+        # Encode longest-first so every batch holds texts of similar length
+        # and pads less, then restore the caller's order
+        order = np.argsort([-len(doc) for doc in documents], kind="stable")
+        vectors = self.embed_text([documents[i] for i in order], batch_size=batch_size)
+        embeddings = np.empty_like(vectors)
+        embeddings[order] = vectors
         return embeddings
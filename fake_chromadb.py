@@ -0,0 +1,79 @@
+"""
+Fake ChromaDB - KREPS Project
+In-memory stand-in for the parts of the chromadb API used by vdb.py, for unit tests
+"""
+
+import types
+from typing import Dict
+
+import numpy as np
+
+# path -> collection name -> FakeCollection, so clients on one directory share data
+_stores: Dict[str, Dict[str, "FakeCollection"]] = {}
+
+
+class FakeCollection:
+    """Collection keeping ids, documents, metadatas and embeddings in insertion order"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows: Dict[str, tuple] = {}
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def add(self, ids, documents, embeddings, metadatas):
+        for chunk_id, document, embedding, metadata in zip(ids, documents, embeddings, metadatas):
+            self.rows[chunk_id] = (document, dict(metadata), np.asarray(embedding, dtype=np.float32))
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        keys = [
+            key for key, (_, metadata, _) in self.rows.items()
+            if (ids is None or key in ids)
+            and (where is None or all(metadata.get(name) == value for name, value in where.items()))
+        ]
+        if limit is not None:
+            keys = keys[offset:offset + limit]
+        return {
+            "ids": keys,
+            "documents": [self.rows[key][0] for key in keys],
+            "metadatas": [self.rows[key][1] for key in keys],
+            "embeddings": np.stack([self.rows[key][2] for key in keys]) if keys else []
+        }
+
+    def delete(self, ids=None, where=None):
+        for key in ids or []:
+            self.rows.pop(key, None)
+
+
+class FakeClient:
+    """PersistentClient whose collections live in memory for the life of the process"""
+
+    def __init__(self, path: str, settings=None):
+        self.collections = _stores.setdefault(path, {})
+
+    def get_collection(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+
+    def create_collection(self, name: str, metadata=None) -> FakeCollection:
+        self.collections[name] = FakeCollection(name)
+        return self.collections[name]
+
+    def delete_collection(self, name: str):
+        del self.collections[name]
+
+
+def modules() -> Dict[str, types.ModuleType]:
+    """
+    sys.modules entries that make the fake importable as chromadb. Install them
+    with unittest.mock.patch.dict(sys.modules, modules()) before importing vdb,
+    so they are removed again when the test module is done
+    """
+    chromadb = types.ModuleType("chromadb")
+    chromadb.PersistentClient = FakeClient
+    config = types.ModuleType("chromadb.config")
+    config.Settings = lambda **kwargs: kwargs
+    chromadb.config = config
+    return {"chromadb": chromadb, "chromadb.config": config}
@@ -2,6 +2,8 @@ import React, { useState, useRef, useEffect } from 'react';
 import { Upload, Send, FileText, Trash2, Database, CheckCircle, Loader, X, Bot, User, FileSearch, BarChart3, PieChart, TrendingUp, Zap } from 'lucide-react';
 
 const API_BASE = 'http://localhost:8000';
+const ALLOWED_EXTENSIONS = ['pdf', 'docx', 'doc'];
+const JOB_POLL_INTERVAL_MS = 1000;
 
 // Easter Egg: Konami Code detector
 const useKonamiCode = (callback) => {
@@ -127,17 +129,39 @@ function App() {
         body: formData
       });
 
-      const results = await response.json();
-
-      newFiles.forEach(file => {
-        setProcessingStatus(prev => ({ ...prev, [file.id]: 'completed' }));
+      const upload = await response.json();
+      if (!response.ok) {
+        throw new Error(upload.error || `Upload failed with status ${response.status}`);
+      }
+
+      // The backend only queues files with an allowed extension, in upload order
+      const accepted = newFiles.filter(file => ALLOWED_EXTENSIONS.includes(file.type));
+      newFiles
+        .filter(file => !accepted.includes(file))
+        .forEach(file => setProcessingStatus(prev => ({ ...prev, [file.id]: 'error' })));
+
+      // 202 Accepted: ingestion runs in the background, poll the job until it finishes
+      const job = await pollIngestionJob(upload.status_url, (status) => {
+        accepted.forEach((file, index) => {
+          const fileStatus = status.file_status[index];
+          setProcessingStatus(prev => ({
+            ...prev,
+            [file.id]: fileStatus === 'failed' ? 'error' : fileStatus === 'completed' ? 'completed' : 'processing'
+          }));
+        });
       });
 
       loadCollectionInfo();
-      alert(`Successfully uploaded ${results.length} document(s)`);
+
+      const completed = job.file_status.filter(status => status === 'completed').length;
+      if (job.errors.length) {
+        alert(`Ingested ${completed} of ${job.files_total} document(s) (${job.chunks_created} chunks).\n\n${job.errors.join('\n')}`);
+      } else {
+        alert(`Ingested ${completed} document(s) (${job.chunks_created} chunks)`);
+      }
     } catch (error) {
       console.error('Upload failed:', error);
-      alert('Upload failed. Make sure the backend is running at ' + API_BASE);
+      alert('Upload failed: ' + error.message + '\nMake sure the backend is running at ' + API_BASE);
 
       newFiles.forEach(file => {
         setProcessingStatus(prev => ({ ...prev, [file.id]: 'error' }));
@@ -145,6 +169,22 @@ function App() {
     }
   };
 
+  const pollIngestionJob = async (statusUrl, onProgress) => {
+    while (true) {
+      const response = await fetch(`${API_BASE}${statusUrl}`);
+      const status = await response.json();
+      if (!response.ok) {
+        throw new Error(status.error || `Job status request failed with status ${response.status}`);
+      }
+
+      onProgress(status);
+      if (status.status !== 'running') {
+        return status;
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   const handleSendMessage = async () => {
     if (!inputMessage.trim() || isThinking) return;
 
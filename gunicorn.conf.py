@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration - KREPS Project
+Run the API server with: gunicorn -c gunicorn.conf.py api:app
+"""
+
+import os
+
+# Same port as api.py run directly, which the frontend (API_BASE) and README use
+bind = os.environ.get("KREPS_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("KREPS_WORKERS", "2"))
+timeout = 180
+
+# Requests spend most of their time waiting on Ollama, so each worker serves
+# several of them on threads; QwenRAGSystem caps how many reach Ollama at once
+worker_class = "gthread"
+threads = int(os.environ.get("KREPS_THREADS", "8"))
+
+# Import api.py, and with it the ~2GB BGE-M3 weights, once in the master.
+# Forked workers then share the weights copy-on-write instead of each loading
+# (and logging) their own copy. A CUDA context cannot cross fork(), so GPU
+# deployments should set KREPS_PRELOAD=0 and let every worker load its own.
+preload_app = os.environ.get("KREPS_PRELOAD", "1") == "1"
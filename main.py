@@ -4,36 +4,57 @@ Orchestrates all modules: ingestion pipeline and RAG query system
 """
 import os
 import sys
-from chunk import process_directory
-from vdb import VectorDatabase
-from embedding import VectorEmbeddingModule
-from rag import QwenRAGSystem
+
+# Module imports live inside the functions that need them, so the menu (and
+# "Exit") doesn't wait for torch, transformers and chromadb to load
 
 
 def run_ingestion_pipeline(folder_path: str, collection_name: str = "kreps_documents"):
     """
     Orchestrates complete ingestion pipeline.
     Connects: Chunking -> Embedding -> VectorDB
+
+    The stages run concurrently: chunking of file N+1 overlaps embedding of
+    file N and the database insert of file N-1.
     """
+    from chunk import find_documents
+    from embedding import VectorEmbeddingModule
+    from pipeline import IngestionPipeline
+    from vdb import VectorDatabase
+
     # Initialize modules
     embedding_module = VectorEmbeddingModule()
     vector_db = VectorDatabase(collection_name=collection_name)
 
-    # Step 1: Chunk documents
-    chunks = process_directory(folder_path, chunk_size=500, chunk_overlap=100)
-    if not chunks:
+    file_paths = find_documents(folder_path)
+    if not file_paths:
         print("ERROR: No documents found")
         return False
 
-    # Step 2: Generate embeddings
-    chunk_texts = [chunk.page_content for chunk in chunks]
-    embeddings = embedding_module.embed_documents(chunk_texts)
+    print(f"Found {len(file_paths)} documents to process")
 
-    # Step 3: Store in vector database
-    vector_db.store_chunks_with_embeddings(
-        chunks=chunks,
-        embeddings=embeddings
+    # Chunk -> embed (batches of 64) -> store, connected by bounded queues
+    pipeline = IngestionPipeline(
+        embedding_module=embedding_module,
+        vector_db=vector_db,
+        batch_size=64,
+        chunk_size=500,
+        chunk_overlap=100
     )
+    job = pipeline.run(file_paths)
+
+    for error in job['errors']:
+        print(f"  ✗ {error}")
+
+    if job['duplicates_skipped']:
+        print(f"Skipped {job['duplicates_skipped']} duplicate chunks")
+
+    if job['unchanged_skipped']:
+        print(f"Skipped {job['unchanged_skipped']} chunks already in the database")
+
+    if not job['chunks_created'] and not job['unchanged_skipped']:
+        print("ERROR: No chunks created")
+        return False
 
     stats = vector_db.get_database_stats()
     print(f"Ingestion complete: {stats['total_chunks']} chunks from {stats['unique_documents']} documents")
@@ -44,6 +65,8 @@ def run_query_mode(collection_name: str = "kreps_documents"):
     """
     Interactive CLI for testing RAG system.
     """
+    from rag import QwenRAGSystem
+
     rag = QwenRAGSystem(
         collection_name=collection_name,
         ollama_model="qwen2.5:latest",
@@ -67,13 +90,23 @@ def run_query_mode(collection_name: str = "kreps_documents"):
             if not query:
                 continue
 
-            result = rag.answer_query(query)
-
-            print(f"\nAnswer: {result['answer']}\n")
-            print(f"Sources ({result['num_chunks']} chunks):")
-            for i, source in enumerate(result['sources'], 1):
-                print(f"  [{i}] {source['filename']} (Page {source['page']}, Score: {source['similarity_score']:.4f})")
-            print()
+            # Print the answer as it is generated
+            print("\nAnswer: ", end="", flush=True)
+            result = None
+            for event in rag.answer_query_stream(query):
+                if 'token' in event:
+                    print(event['token'], end="", flush=True)
+                elif 'error' in event:
+                    print(event['error'], end="")
+                else:
+                    result = event
+            print("\n")
+
+            if result is not None:
+                print(f"Sources ({result['num_chunks']} chunks):")
+                for i, source in enumerate(result['sources'], 1):
+                    print(f"  [{i}] {source.filename} (Page {source.page}, Score: {source.similarity_score:.4f})")
+                print()
 
         except KeyboardInterrupt:
             break
@@ -87,7 +120,7 @@ def run_api_server():
     """
     print("Starting API server on http://localhost:5000\n")
     from api import app
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
 
 
 def main():
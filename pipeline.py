@@ -0,0 +1,343 @@
+"""
+Ingestion Pipeline Module - KREPS Project
+Runs Load -> Chunk -> Embed -> Upsert as overlapping stages connected by bounded queues
+"""
+
+import os
+import queue
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import IO, Dict, List, Optional, Tuple
+
+import xxhash
+
+from chunk import process_document, process_stream
+
+
+class IngestionPipeline:
+    """
+    Persistent ingestion workers shared across requests.
+
+    Files are loaded and chunked on a thread pool, embedded in micro-batches
+    by a single embedding worker and written by a single writer thread, so
+    chunking of file N+1 overlaps embedding of file N and the upsert of
+    file N-1. Bounded queues between the stages provide backpressure.
+    """
+
+    def __init__(
+            self,
+            embedding_module,
+            vector_db,
+            load_workers: int = 2,
+            batch_size: int = 64,
+            queue_size: int = 4,
+            chunk_size: int = 500,
+            chunk_overlap: int = 100,
+            max_finished_jobs: int = 256,
+            deduplicate: bool = True,
+            skip_unchanged: bool = True
+    ):
+        """
+        Initialize the pipeline and start its workers.
+
+        Args:
+            embedding_module: VectorEmbeddingModule instance
+            vector_db: VectorDatabase instance
+            load_workers: Number of threads loading and chunking documents
+            batch_size: Number of chunks embedded per micro-batch
+            queue_size: Maximum number of items waiting between two stages
+            chunk_size: Chunk size passed to process_document
+            chunk_overlap: Chunk overlap passed to process_document
+            max_finished_jobs: Number of finished jobs kept for status lookups
+            deduplicate: Skip chunks whose text (ignoring case and whitespace) was
+                already embedded earlier in the same job
+            skip_unchanged: Skip chunks whose exact text is already stored for the
+                same file, so re-ingesting a folder only embeds what changed
+        """
+        self.embedding_module = embedding_module
+        self.vector_db = vector_db
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_finished_jobs = max_finished_jobs
+        self.deduplicate = deduplicate
+        self.skip_unchanged = skip_unchanged
+
+        self._jobs: Dict[str, Dict] = {}
+        self._events: Dict[str, threading.Event] = {}
+        # job_id -> fingerprints of the chunks embedded so far (embedding thread only)
+        self._seen_chunks: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+        self._load_pool = ThreadPoolExecutor(max_workers=load_workers, thread_name_prefix="kreps-load")
+        self._embed_queue = queue.Queue(maxsize=queue_size)
+        self._store_queue = queue.Queue(maxsize=queue_size)
+
+        # Worker threads start on first use: threads do not survive fork(), so
+        # a pipeline created in a preloading gunicorn master must not own any
+        self._workers_started = False
+
+    def submit(self, file_paths: List[str]) -> str:
+        """
+        Queue documents on disk for ingestion without waiting for them.
+
+        Args:
+            file_paths: Paths of the documents to ingest
+
+        Returns:
+            Job ID that can be passed to get_job / wait
+        """
+        return self._submit([
+            {"filename": os.path.basename(path), "path": path}
+            for path in file_paths
+        ])
+
+    def submit_uploads(self, uploads: List[Tuple[str, IO[bytes]]], persist_dir: Optional[str] = None) -> str:
+        """
+        Queue in-memory uploads for ingestion without waiting for them.
+
+        Each upload is chunked straight from its stream. It is written to
+        persist_dir only after all of its chunks were embedded and stored,
+        so failed uploads leave nothing behind on disk.
+
+        Args:
+            uploads: (filename, seekable binary stream) pairs; the pipeline closes the streams
+            persist_dir: Directory the original files are saved to, or None to discard them
+
+        Returns:
+            Job ID that can be passed to get_job / wait
+        """
+        return self._submit([
+            {
+                "filename": filename,
+                "stream": stream,
+                "persist_path": os.path.join(persist_dir, filename) if persist_dir else None
+            }
+            for filename, stream in uploads
+        ])
+
+    def _submit(self, sources: List[Dict]) -> str:
+        """Register a job and hand its sources to the loader pool."""
+        job_id = uuid.uuid4().hex
+        for index, source in enumerate(sources):
+            source["index"] = index
+        job = {
+            "job_id": job_id,
+            "status": "running" if sources else "completed",
+            "files": [source["filename"] for source in sources],
+            # Per file, in the order of "files": queued -> completed / failed
+            "file_status": ["queued"] * len(sources),
+            "files_total": len(sources),
+            "files_processed": 0,
+            "chunks_created": 0,
+            "duplicates_skipped": 0,
+            "unchanged_skipped": 0,
+            "errors": [],
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None if sources else datetime.now().isoformat()
+        }
+
+        event = threading.Event()
+        with self._lock:
+            self._prune_jobs()
+            self._jobs[job_id] = job
+            self._events[job_id] = event
+
+        if not sources:
+            event.set()
+
+        self._start_workers()
+        for source in sources:
+            self._load_pool.submit(self._load, job_id, source)
+
+        return job_id
+
+    def _start_workers(self):
+        """Start the embedding and writer threads once per process."""
+        with self._lock:
+            if self._workers_started:
+                return
+            self._workers_started = True
+
+        threading.Thread(target=self._embed_worker, name="kreps-embed", daemon=True).start()
+        threading.Thread(target=self._store_worker, name="kreps-store", daemon=True).start()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get a snapshot of a job's progress, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, "errors": list(job["errors"]), "file_status": list(job["file_status"])}
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Block until a job has finished and return its final state."""
+        event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get_job(job_id)
+
+    def run(self, file_paths: List[str]) -> Dict:
+        """Ingest documents and block until all of them are stored."""
+        return self.wait(self.submit(file_paths))
+
+    def _load(self, job_id: str, source: Dict):
+        """Stage 1: load and chunk one document."""
+        try:
+            if "stream" in source:
+                chunks = process_stream(
+                    source["stream"],
+                    source["filename"],
+                    chunk_size=self.chunk_size,
+                    chunk_overlap=self.chunk_overlap
+                )
+            else:
+                chunks = process_document(
+                    source["path"],
+                    chunk_size=self.chunk_size,
+                    chunk_overlap=self.chunk_overlap
+                )
+        except Exception as e:
+            self._record_error(job_id, source, e)
+            chunks = []
+
+        self._embed_queue.put((job_id, source, chunks))
+
+    def _embed_worker(self):
+        """Stage 2: embed chunks in micro-batches."""
+        while True:
+            job_id, source, chunks = self._embed_queue.get()
+            try:
+                self._embed_file(job_id, source, chunks)
+            except Exception as e:
+                # This is the only embedding thread: fail the file, not the stage
+                self._record_error(job_id, source, e)
+                self._store_queue.put((job_id, source, [], None, True))
+
+    def _embed_file(self, job_id: str, source: Dict, chunks: List):
+        """Embed one file's chunks and hand them to the writer, ending with an is_last item."""
+        if self.deduplicate and chunks:
+            chunks = self._drop_duplicates(job_id, source, chunks)
+
+        if self.skip_unchanged and chunks:
+            chunks = self._drop_unchanged(job_id, source, chunks)
+
+        if not chunks:
+            self._store_queue.put((job_id, source, [], None, True))
+            return
+
+        for start in range(0, len(chunks), self.batch_size):
+            batch = chunks[start:start + self.batch_size]
+            is_last = start + self.batch_size >= len(chunks)
+            embeddings = self.embedding_module.embed_documents(
+                [chunk.page_content for chunk in batch],
+                batch_size=self.batch_size
+            )
+            self._store_queue.put((job_id, source, batch, embeddings, is_last))
+
+    def _drop_duplicates(self, job_id: str, source: Dict, chunks: List) -> List:
+        """Remove chunks already seen in this job, such as repeated headers, footers or pages."""
+        seen = self._seen_chunks.setdefault(job_id, set())
+        unique = []
+        for chunk in chunks:
+            fingerprint = xxhash.xxh64(" ".join(chunk.page_content.lower().split()).encode("utf-8")).intdigest()
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                unique.append(chunk)
+
+        skipped = len(chunks) - len(unique)
+        if skipped:
+            print(f"{source['filename']}: skipped {skipped} duplicate chunks ({len(chunks)} -> {len(unique)})")
+            with self._lock:
+                self._jobs[job_id]["duplicates_skipped"] += skipped
+        return unique
+
+    def _drop_unchanged(self, job_id: str, source: Dict, chunks: List) -> List:
+        """Remove chunks whose text is already stored for the same file, before they reach the encoder."""
+        try:
+            stored = self.vector_db.get_document_text_hashes(source["filename"])
+        except Exception as e:
+            print(f"Warning: Could not read stored chunks of {source['filename']}: {e}")
+            return chunks
+        if not stored:
+            return chunks
+
+        changed = [chunk for chunk in chunks if self.vector_db.text_hash(chunk.page_content) not in stored]
+
+        skipped = len(chunks) - len(changed)
+        if skipped:
+            print(f"{source['filename']}: {skipped} chunks unchanged since the last ingestion")
+            with self._lock:
+                self._jobs[job_id]["unchanged_skipped"] += skipped
+        return changed
+
+    def _store_worker(self):
+        """Stage 3: upsert embedded chunks into the vector database."""
+        while True:
+            job_id, source, batch, embeddings, is_last = self._store_queue.get()
+
+            if batch:
+                try:
+                    self.vector_db.store_chunks_with_embeddings(batch, embeddings)
+                    with self._lock:
+                        self._jobs[job_id]["chunks_created"] += len(batch)
+                except Exception as e:
+                    self._record_error(job_id, source, e)
+
+            if is_last:
+                try:
+                    self._release_source(job_id, source)
+                except Exception as e:
+                    # This is the only writer thread: fail the file, not the stage
+                    self._record_error(job_id, source, e)
+                self._finish_file(job_id, source)
+
+    def _release_source(self, job_id: str, source: Dict):
+        """Persist a fully ingested upload and close its stream."""
+        stream = source.get("stream")
+        if stream is None:
+            return
+
+        try:
+            if source.get("persist_path") and not source.get("failed"):
+                stream.seek(0)
+                with open(source["persist_path"], "wb") as f:
+                    shutil.copyfileobj(stream, f)
+        except Exception as e:
+            self._record_error(job_id, source, e)
+        finally:
+            stream.close()
+
+    def _finish_file(self, job_id: str, source: Dict):
+        """Mark one file of a job as done and close the job after the last one."""
+        with self._lock:
+            job = self._jobs[job_id]
+            job["file_status"][source["index"]] = "failed" if source.get("failed") else "completed"
+            job["files_processed"] += 1
+            if job["files_processed"] < job["files_total"]:
+                return
+            job["status"] = "failed" if job["errors"] and not job["chunks_created"] else "completed"
+            job["finished_at"] = datetime.now().isoformat()
+            self._seen_chunks.pop(job_id, None)
+
+        self._events[job_id].set()
+        print(f"Ingestion job {job_id} {job['status']}: {job['chunks_created']} chunks "
+              f"from {job['files_total']} file(s)")
+
+    def _record_error(self, job_id: str, source: Dict, error: Exception):
+        """Attach an error to a job and mark the source it came from as failed."""
+        source["failed"] = True
+        message = f"{source['filename']}: {error}"
+        print(f"Ingestion error ({job_id}): {message}")
+        with self._lock:
+            self._jobs[job_id]["errors"].append(message)
+
+    def _prune_jobs(self):
+        """Forget the oldest finished jobs once too many are kept (lock held)."""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] != "running"]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+            del self._events[job_id]
@@ -3,25 +3,108 @@ Prompt Augmentation Module
 Formats retrieved context and user query into structured prompt for LLM
 """
 
-from langchain.prompts import PromptTemplate
-from typing import List, Dict
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple
+import functools
+import threading
+
+import numpy as np
+
+# Placeholder values used once to locate {context} and {question} in the formatted template
+_CONTEXT_SENTINEL = "\x00CTX\x00"
+_QUESTION_SENTINEL = "\x00Q\x00"
+
+
+@dataclass(frozen=True, slots=True)
+class Source:
+    """One retrieved chunk as reported alongside an answer"""
+    filename: str
+    page: int
+    similarity_score: float
+    chunk_id: str
+    content: str
+
+
+@functools.lru_cache(maxsize=None)
+def _load_tokenizer(tokenizer_name: str):
+    """Load a HuggingFace tokenizer once per process, or None if it can't be loaded"""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+
+    try:
+        # Try offline / cached first
+        return AutoTokenizer.from_pretrained(tokenizer_name, local_files_only=True)
+    except Exception:
+        pass
+
+    try:
+        return AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        print(f"Warning: Could not load tokenizer {tokenizer_name}, estimating token counts instead: {e}")
+        return None
+
 
 class PrompterModule:
     """Handles prompt construction for RAG pipeline"""
 
-    def __init__(self, max_context_tokens: int = 5000):
+    def __init__(
+            self,
+            max_context_tokens: int = 5000,
+            context_cache_size: int = 128,
+            use_langchain: bool = False,
+            tokenizer_name: Optional[str] = "Qwen/Qwen2.5-0.5B"
+    ):
         """
         Initialize prompter module
 
         Args:
             max_context_tokens: Maximum tokens for context
+            context_cache_size: Number of formatted contexts (with their entry order) kept, keyed by their chunk IDs
+            use_langchain: Format prompts with LangChain's PromptTemplate instead of the precompiled template
+            tokenizer_name: Tokenizer of the LLM, used to count context tokens exactly.
+                None (or a tokenizer that can't be loaded) falls back to a character-based estimate
         """
         self.max_context_tokens = max_context_tokens
-        self.template = self._create_template()
+        self.tokenizer = _load_tokenizer(tokenizer_name) if tokenizer_name else None
+        self.context_cache_size = context_cache_size
+        self.use_langchain = use_langchain
+        self._template = None
+
+        # The template is split once at its placeholders, so building a
+        # prompt is a plain concatenation instead of a PromptTemplate.format call
+        self._pre, self._mid, self._suf = self._split_template(self._template_text())
+
+        self._context_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def template(self):
+        """LangChain PromptTemplate for the RAG prompt, created on first use"""
+        if self._template is None:
+            self._template = self._create_template()
+        return self._template
 
-    def _create_template(self) -> PromptTemplate:
+    def _create_template(self):
         """Create RAG prompt template"""
-        template = """You are a factual assistant.
+        from langchain.prompts import PromptTemplate
+
+        return PromptTemplate(
+            input_variables=["context", "question"],
+            template=self._template_text()
+        )
+
+    @staticmethod
+    def _template_text() -> str:
+        """
+        RAG prompt template text
+
+        Everything above {context} is byte-identical for every query, so the
+        LLM server can reuse its KV cache for that prefix; the question comes last.
+        """
+        return """You are a factual assistant.
         Answer the question using ONLY the provided context.
 
         Style:
@@ -42,10 +125,13 @@ class PrompterModule:
         Answer:
         """
 
-        return PromptTemplate(
-            input_variables=["context", "question"],
-            template=template
-        )
+    @staticmethod
+    def _split_template(template: str) -> Tuple[str, str, str]:
+        """Split a template into the text before {context}, between the placeholders, and after {question}"""
+        formatted = template.format(context=_CONTEXT_SENTINEL, question=_QUESTION_SENTINEL)
+        pre, rest = formatted.split(_CONTEXT_SENTINEL, 1)
+        mid, suf = rest.split(_QUESTION_SENTINEL, 1)
+        return pre, mid, suf
 
     def _estimate_tokens(self, text: str) -> int:
         """
@@ -59,36 +145,109 @@ class PrompterModule:
         """
         return max(len(text) // 4, len(text.split()))
 
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        Count tokens for several texts with one tokenizer call
+
+        Args:
+            texts: Input text strings
+
+        Returns:
+            Token count per text (estimated if no tokenizer is available)
+        """
+        if self.tokenizer is not None and texts:
+            try:
+                encoded = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+                return [len(ids) for ids in encoded]
+            except Exception:
+                pass
+        return [self._estimate_tokens(text) for text in texts]
+
     def format_context(self, retrieved_chunks: List[Dict]) -> str:
         """
         Format retrieved chunks into context string
 
+        Chunks are picked in relevance order until the token budget is used
+        up, then written out in document order (filename, then chunk index).
+        Queries that retrieve the same chunks therefore produce the same
+        context text (and the same prompt prefix) whatever their ranking.
+
         Args:
             retrieved_chunks: List of chunks from ContextRetrieval
 
         Returns:
             Formatted context string
         """
-        context_parts = []
-        total_tokens = 0
+        context, _ = self._format_context(retrieved_chunks, [self._chunk_body(chunk) for chunk in retrieved_chunks])
+        return context
 
+    def _format_context(self, retrieved_chunks: List[Dict], bodies: List[str]) -> Tuple[str, List[int]]:
+        """
+        format_context with the entry bodies already built
 
-        for i, chunk in enumerate(retrieved_chunks, 1):
-            content = chunk.get('content', '')
-            metadata = chunk.get('metadata', {})
-            filename = metadata.get("filename", metadata.get("source", "Unknown"))
-            page = metadata.get("page", None)
-            page_str = f", Page: {page}" if page is not None else ""
-            part = f"[{i}] Source: {filename}{page_str}\n{content}\n"
-            part_tokens = self._estimate_tokens(part)
+        Returns:
+            (context string, indices into retrieved_chunks of its entries [1], [2], ... in order)
+        """
+        part_token_counts = self._count_tokens([f"[{i}] {body}" for i, body in enumerate(bodies, 1)])
+
+        # Longest prefix of the ranking whose running token total fits the budget
+        cutoff = int(np.searchsorted(np.cumsum(part_token_counts), self.max_context_tokens, side='right'))
 
-            if total_tokens + part_tokens > self.max_context_tokens:
-                break
+        key = self._context_key(retrieved_chunks[:cutoff])
+        if key is not None:
+            with self._cache_lock:
+                cached = self._context_cache.get(key)
+                if cached is not None:
+                    self._context_cache.move_to_end(key)
+            if cached is not None:
+                # The entry order is the cached one: ties in _document_order are
+                # broken by rank, which differs between rankings of the same chunks
+                context, chunk_ids = cached
+                position = {chunk['chunk_id']: i for i, chunk in enumerate(retrieved_chunks[:cutoff])}
+                return context, [position[chunk_id] for chunk_id in chunk_ids]
+
+        selected = sorted(range(cutoff), key=lambda i: self._document_order(retrieved_chunks[i], i))
+        context = "\n".join(f"[{n}] {bodies[i]}" for n, i in enumerate(selected, 1))
+
+        if key is not None:
+            with self._cache_lock:
+                self._context_cache[key] = (context, [retrieved_chunks[i]['chunk_id'] for i in selected])
+                if len(self._context_cache) > self.context_cache_size:
+                    self._context_cache.popitem(last=False)
+
+        return context, selected
+
+    @staticmethod
+    def _document_order(chunk: Dict, rank: int) -> tuple:
+        """
+        Sort key placing a chunk by its position in its document
+
+        Chunk indices compare as numbers (chunk 10 after chunk 9); chunks without
+        one go after the indexed chunks of their file, in relevance order.
+        """
+        metadata = chunk.get('metadata', {})
+        filename = metadata.get("filename", metadata.get("source", "Unknown"))
+        try:
+            return filename, 0, int(metadata['chunk_index']), rank
+        except (KeyError, TypeError, ValueError):
+            return filename, 1, 0, rank
 
-            context_parts.append(part)
-            total_tokens += part_tokens
+    def _chunk_body(self, chunk: Dict) -> str:
+        """Source line and content of one context entry, without its number"""
+        content = chunk.get('content', '')
+        metadata = chunk.get('metadata', {})
+        filename = metadata.get("filename", metadata.get("source", "Unknown"))
+        page = metadata.get("page", None)
+        page_str = f", Page: {page}" if page is not None else ""
+        return f"Source: {filename}{page_str}\n{content}\n"
 
-        return "\n".join(context_parts)
+    @staticmethod
+    def _context_key(chunks: List[Dict]) -> Optional[frozenset]:
+        """Cache key for a set of chunks, or None if they can't be identified by ID"""
+        chunk_ids = [chunk.get('chunk_id') for chunk in chunks]
+        if not chunk_ids or not all(chunk_ids) or len(set(chunk_ids)) != len(chunk_ids):
+            return None
+        return frozenset(chunk_ids)
 
     def augment_prompt(self, query: str, retrieved_chunks: List[Dict]) -> str:
         """
@@ -102,6 +261,42 @@ class PrompterModule:
             Formatted prompt string ready for LLM
         """
         context = self.format_context(retrieved_chunks)
-        prompt = self.template.format(context=context, question=query)
-        return prompt
+        return self._build_prompt(context, query)
+
+    def augment_prompt_with_sources(self, query: str, retrieved_chunks: List[Dict]) -> Tuple[str, List[Source]]:
+        """
+        Create augmented prompt and the matching source list in one pass over the chunks
+
+        Args:
+            query: User question (string)
+            retrieved_chunks: Retrieved context chunks from ContextRetrieval
+
+        Returns:
+            (prompt string ready for LLM, one Source per chunk in the context).
+            Sources follow the context entries, so citation [n] is sources[n - 1];
+            chunks cut off by the token budget are not included
+        """
+        bodies = [self._chunk_body(chunk) for chunk in retrieved_chunks]
+        context, selected = self._format_context(retrieved_chunks, bodies)
+
+        sources = []
+        for i in selected:
+            chunk = retrieved_chunks[i]
+            content = chunk.get('content', '')
+            metadata = chunk.get('metadata', {})
+            sources.append(Source(
+                filename=metadata.get('filename', 'unknown'),
+                page=metadata.get('page', 0),
+                similarity_score=round(chunk.get('similarity_score', 0.0), 4),
+                chunk_id=chunk.get('chunk_id'),
+                content=content[:200] + '...' if len(content) > 200 else content
+            ))
+
+        return self._build_prompt(context, query), sources
+
+    def _build_prompt(self, context: str, query: str) -> str:
+        """Fill the template with a formatted context and the question"""
+        if self.use_langchain:
+            return self.template.format(context=context, question=query)
+        return f"{self._pre}{context}{self._mid}{query}{self._suf}"
 
@@ -4,13 +4,24 @@ Handles complete RAG pipeline with Qwen 2.5 14B via Ollama
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import atexit
-from typing import Dict, List, Optional
+import orjson
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 from vdb import VectorDatabase
 from embedding import VectorEmbeddingModule
 from similarity import SimilaritySearch
 from retrieval import ContextRetrieval
 from prompter import PrompterModule
+from cache import SemanticCache
+
+# Request bodies are serialized with orjson, so the content type is set by hand
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class QwenRAGSystem:
@@ -23,7 +34,14 @@ class QwenRAGSystem:
             ollama_model: str = "qwen2.5:latest",
             ollama_url: str = "http://localhost:11434",
             top_k: int = 5,
-            auto_cleanup: bool = True
+            auto_cleanup: bool = False,
+            cache_threshold: Optional[float] = None,
+            cache_size: int = 512,
+            brute_force_threshold: int = 50_000,
+            retrieval_cache_threshold: float = 0.985,
+            retrieval_cache_size: int = 256,
+            keep_alive: str = "30m",
+            max_concurrent_generations: int = 4
     ):
         self.ollama_model = ollama_model
         self.ollama_url = ollama_url
@@ -32,20 +50,87 @@ class QwenRAGSystem:
         self.collection_name = collection_name
         self.auto_cleanup = auto_cleanup
         self.model = ollama_model
-
-        self.vector_db = VectorDatabase(collection_name=collection_name)
+        # How long Ollama keeps the model loaded after a request ("-1" = forever)
+        self.keep_alive = keep_alive
+
+        # Concurrent requests overlap retrieval freely, but only this many
+        # generations (per process) are sent to Ollama at once so they don't thrash the GPU
+        self._generation_slots = threading.BoundedSemaphore(max_concurrent_generations)
+
+        # One keep-alive connection pool to Ollama per process (see _session)
+        self._http_session = None
+        self._session_pid = None
+
+        # Background requests that load the model while retrieval runs. The pool
+        # is created per process: its threads would not survive a gunicorn preload fork
+        self._pool = None
+        self._pool_pid = None
+        self._last_warmup = None
+
+        # With auto_cleanup, chunks stored by this process are tagged so that
+        # only they are removed at exit; the persistent collection survives
+        self.session_id = uuid.uuid4().hex if auto_cleanup else None
+        self.vector_db = VectorDatabase(collection_name=collection_name, session_id=self.session_id)
         self.embedding_module = VectorEmbeddingModule()
-        self.similarity = SimilaritySearch(self.vector_db, self.embedding_module)
-        self.retrieval = ContextRetrieval(self.similarity, top_k=top_k)
+        self.similarity = SimilaritySearch(
+            self.vector_db, self.embedding_module, brute_force_threshold=brute_force_threshold
+        )
+        # Load the in-memory corpus matrix now rather than on the first query
+        # (no-op for collections at or above brute_force_threshold)
+        self.similarity.brute_force.available()
+        # Near-duplicate queries (cosine >= retrieval_cache_threshold) reuse earlier search results;
+        # lower thresholds also match questions that need different chunks
+        self.retrieval = ContextRetrieval(
+            self.similarity,
+            top_k=top_k,
+            cache=SemanticCache(max_size=retrieval_cache_size, threshold=retrieval_cache_threshold)
+        )
         self.prompter = PrompterModule()
 
+        # Repeated questions (same text up to case and whitespace) are served
+        # without retrieval or generation. Matching merely similar questions is
+        # opt-in via cache_threshold: near-identical wording such as "in 2023"
+        # vs "in 2024" embeds above 0.97 yet needs a different answer
+        self.cache_threshold = cache_threshold
+        self.answer_cache = SemanticCache(
+            max_size=cache_size, threshold=1.0 if cache_threshold is None else cache_threshold
+        )
+        self._answer_cache_version = self.vector_db.write_version
+
         if self.auto_cleanup:
             atexit.register(self.cleanup_on_exit)
 
+        # Start loading the model now so the first question doesn't pay for it
+        self._warm_up()
+
+    @property
+    def _session(self) -> requests.Session:
+        """
+        HTTP session reused for every Ollama request in this process.
+
+        Created lazily per process, so workers forked from a preloading
+        gunicorn master never share the master's pooled sockets.
+        """
+        if self._http_session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            session.headers.update({"Connection": "keep-alive"})
+            self._http_session = session
+            self._session_pid = os.getpid()
+        return self._http_session
+
     def answer_query(self, query: str, store_scores: bool = True) -> Dict:
         """Main method: Complete pipeline from user query to answer."""
+        self._warm_up()
         try:
-            contexts = self.retrieval.retrieve_context(query, store_scores=store_scores)
+            cached, query_embedding = self._cached_answer(query)
+            if cached is not None:
+                return cached
+
+            contexts = self.retrieval.retrieve_context(
+                query, store_scores=store_scores, query_embedding=query_embedding
+            )
 
             if not contexts:
                 return {
@@ -56,26 +141,19 @@ class QwenRAGSystem:
                     'num_chunks': 0
                 }
 
-            prompt = self.prompter.augment_prompt(query, contexts)
+            prompt, sources = self.prompter.augment_prompt_with_sources(query, contexts)
             answer = self._generate_with_qwen(prompt)
 
             result = {
                 'answer': answer,
                 'query': query,
-                'sources': [
-                    {
-                        'filename': ctx['metadata'].get('filename', 'unknown'),
-                        'page': ctx['metadata'].get('page', 0),
-                        'similarity_score': round(ctx['similarity_score'], 4),
-                        'chunk_id': ctx['chunk_id'],
-                        'content': ctx['content'][:200] + '...' if len(ctx['content']) > 200 else ctx['content']
-                    }
-                    for ctx in contexts
-                ],
+                'sources': sources,
                 'model': self.ollama_model,
-                'num_chunks': len(contexts)
+                # Chunks that fit the context budget, one per source
+                'num_chunks': len(sources)
             }
 
+            self._cache_answer(query, query_embedding, result)
             return result
 
         except Exception as e:
@@ -88,22 +166,185 @@ class QwenRAGSystem:
                 'error': str(e)
             }
 
+    def answer_query_stream(self, query: str, store_scores: bool = True) -> Iterator[Dict]:
+        """
+        Streaming variant of answer_query.
+
+        Yields {'token': str} events as Ollama produces them, then one final
+        {'sources': [Source, ...], 'model': str, 'num_chunks': int} event. Failures are
+        reported as an {'error': str} event in place of the remaining tokens.
+        """
+        self._warm_up()
+        try:
+            cached, query_embedding = self._cached_answer(query)
+            if cached is None:
+                contexts = self.retrieval.retrieve_context(
+                    query, store_scores=store_scores, query_embedding=query_embedding
+                )
+        except Exception as e:
+            yield {'error': f'Error processing query: {str(e)}'}
+            return
+
+        if cached is not None:
+            yield {'token': cached['answer']}
+            yield {key: cached[key] for key in ('sources', 'model', 'num_chunks')}
+            return
+
+        tokens = []
+        sources = []
+        if not contexts:
+            yield {'token': 'No relevant information found in the database.'}
+        else:
+            prompt, sources = self.prompter.augment_prompt_with_sources(query, contexts)
+            try:
+                for token in self._stream_with_qwen(prompt):
+                    tokens.append(token)
+                    yield {'token': token}
+
+            except requests.exceptions.Timeout:
+                yield {'error': "Error: Request timed out. Model is taking too long to respond."}
+                return
+
+            except requests.exceptions.ConnectionError:
+                yield {'error': "Error: Cannot connect to Ollama. Make sure Ollama is running on localhost:11434"}
+                return
+
+            except Exception as e:
+                yield {'error': f"Error generating answer: {str(e)}"}
+                return
+
+        final = {
+            'sources': sources,
+            'model': self.ollama_model,
+            'num_chunks': len(sources)
+        }
+
+        if contexts and tokens:
+            self._cache_answer(query, query_embedding, {'answer': ''.join(tokens), 'query': query, **final})
+
+        yield final
+
+    def _warm_up(self, min_interval: float = 60.0):
+        """
+        Ask Ollama to load the model without waiting for it.
+
+        An empty prompt only loads the model into memory, so a cold model is
+        paged in while the query is embedded and searched. Skipped when a
+        warm-up was sent less than min_interval seconds ago.
+        """
+        now = time.monotonic()
+        if self._last_warmup is not None and now - self._last_warmup < min_interval:
+            return
+        self._last_warmup = now
+
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kreps-ollama")
+            self._pool_pid = os.getpid()
+
+        future = self._pool.submit(
+            self._session.post,
+            self.generate_endpoint,
+            data=orjson.dumps({"model": self.model, "prompt": "", "keep_alive": self.keep_alive}),
+            headers=_JSON_HEADERS,
+            timeout=120
+        )
+        # Failures surface on the real request; only keep them out of the logs here
+        future.add_done_callback(lambda f: f.exception())
+
+    def _cached_answer(self, query: str) -> tuple:
+        """
+        Look up a cached answer for the query.
+
+        Returns:
+            (result or None, query embedding or None). The embedding is only
+            computed when the exact-text lookup misses and similar questions
+            are matched (cache_threshold set); it is handed on to retrieval so
+            the query is embedded at most once.
+        """
+        # New or deleted chunks can change any answer
+        if self.vector_db.write_version != self._answer_cache_version:
+            self.answer_cache.clear()
+            self._answer_cache_version = self.vector_db.write_version
+
+        query_embedding = None
+        cached = self.answer_cache.get(query)
+        if cached is None and self.cache_threshold is not None:
+            query_embedding = self.similarity.embed_query(query)
+            cached = self.answer_cache.get_similar(query_embedding)
+
+        if cached is None:
+            return None, query_embedding
+
+        # Sources are immutable, so only the result dict and list need copying
+        return {**cached, 'query': query, 'sources': list(cached['sources'])}, query_embedding
+
+    def _cache_answer(self, query: str, query_embedding, result: Dict):
+        """Cache a successful answer (generation errors are never cached)."""
+        if not result['sources'] or result['answer'].startswith('Error'):
+            return
+
+        if query_embedding is None:
+            query_embedding = self.similarity.embed_query(query)
+        self.answer_cache.put(query, query_embedding, result)
+
+    def _generation_payload(self, prompt: str, stream: bool) -> Dict:
+        """Request body for Ollama's /api/generate."""
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": 0.2,
+                "num_predict": 2048,
+                "top_p": 0.9,
+                "top_k": 40
+            }
+        }
+
+    def _stream_with_qwen(self, prompt: str) -> Iterator[str]:
+        """
+        Generate an answer with Ollama and yield text fragments as they are decoded.
+
+        Raises:
+            RuntimeError: If Ollama answers with an error status or error message
+        """
+        payload = self._generation_payload(prompt, stream=True)
+
+        # (connect, read) timeout: the read timeout applies between tokens,
+        # not to the whole generation. The slot is held until the stream ends
+        # or the consumer stops iterating.
+        with self._generation_slots, \
+                self._session.post(self.generate_endpoint, data=orjson.dumps(payload), headers=_JSON_HEADERS,
+                                   stream=True, timeout=(10, 120)) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Ollama API returned status {response.status_code}: {response.text}")
+
+            # Ollama streams one JSON object per line
+            for line in response.iter_lines():
+                if not line:
+                    continue
+
+                data = orjson.loads(line)
+                if "error" in data:
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+
+                token = data.get("response", "")
+                if token:
+                    yield token
+
+                if data.get("done"):
+                    break
+
     def _generate_with_qwen(self, prompt: str) -> str:
         """Generate answer using local Ollama model (e.g., qwen3:4b)."""
         try:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.2,
-                    "num_predict": 2048,
-                    "top_p": 0.9,
-                    "top_k": 40
-                }
-            }
+            payload = self._generation_payload(prompt, stream=False)
 
-            response = requests.post(self.generate_endpoint, json=payload, timeout=120)
+            with self._generation_slots:
+                response = self._session.post(
+                    self.generate_endpoint, data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=120
+                )
 
             # If Ollama returns an error, include the body so you can see why
             if response.status_code != 200:
@@ -111,7 +352,7 @@ class QwenRAGSystem:
 
             # Parse JSON safely
             try:
-                data = response.json()
+                data = orjson.loads(response.content)
             except Exception:
                 return f"Error: Ollama returned non-JSON response: {response.text}"
 
@@ -137,7 +378,7 @@ class QwenRAGSystem:
     def _test_ollama(self) -> bool:
         """Test if Ollama is running and the configured model exists locally."""
         try:
-            r = requests.get("http://localhost:11434/api/tags", timeout=3)
+            r = self._session.get(f"{self.ollama_url}/api/tags", timeout=3)
             if r.status_code != 200:
                 return False
 
@@ -151,6 +392,13 @@ class QwenRAGSystem:
         """Get database statistics."""
         return self.vector_db.get_database_stats()
 
+    def get_cache_stats(self) -> Dict:
+        """Get hit/miss counters of the answer and retrieval caches."""
+        return {
+            'answer_cache': self.answer_cache.stats(),
+            'retrieval_cache': self.retrieval.cache.stats()
+        }
+
     def health_check(self) -> Dict:
         """Check if all components are working."""
         try:
@@ -173,15 +421,28 @@ class QwenRAGSystem:
             }
 
     def cleanup_on_exit(self):
-        """Delete all data when application exits for security."""
+        """Delete the chunks stored by this session when the application exits."""
         try:
-            self.delete_all_data()
+            if self.session_id:
+                print(f"WARNING: auto_cleanup is on, deleting chunks stored by session {self.session_id}")
+                self.vector_db.delete_session_chunks(self.session_id)
         except Exception as e:
             pass
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            if self._http_session is not None:
+                self._http_session.close()
 
     def delete_all_data(self):
-        """Delete entire collection from ChromaDB."""
-        self.vector_db.client.delete_collection(name=self.collection_name)
+        """
+        Delete every chunk, leaving an empty collection.
+
+        Goes through reset_database so the file index, vector file, ANN index
+        and write_version (and with it the in-memory search copies and the
+        answer / retrieval caches) are reset together with the collection.
+        """
+        self.vector_db.reset_database()
 
 
 if __name__ == "__main__":
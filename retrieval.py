@@ -3,55 +3,98 @@ Context Retrieval Module - KREPS Project
 Retrieves and formats relevant context for LLM
 """
 
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Optional
 from similarity import SimilaritySearch
+from cache import SemanticCache
 
 
 class ContextRetrieval:
-    def __init__(self, similarity_search: SimilaritySearch, top_k: int = 6):
+    def __init__(
+            self,
+            similarity_search: SimilaritySearch,
+            top_k: int = 6,
+            cache: Optional[SemanticCache] = None
+    ):
         self.similarity_search = similarity_search
         self.top_k = top_k
+        self.cache = cache if cache is not None else SemanticCache()
+        self._cache_version = similarity_search.vector_db.write_version
+        # Retrieval metadata is written in the background so queries don't wait on it
+        self._metadata_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kreps-retrieval-metadata")
 
     def retrieve_context(
             self,
             query: str,
             top_k: int = None,
-            store_scores: bool = True
+            store_scores: bool = True,
+            query_embedding=None
     ) -> List[Dict]:
         k = top_k or self.top_k
+        vector_db = self.similarity_search.vector_db
+
+        # New or deleted chunks invalidate every cached result
+        if vector_db.write_version != self._cache_version:
+            self.cache.clear()
+            self._cache_version = vector_db.write_version
+
+        # L1: identical query text, no embedding needed
+        cached = self.cache.get(query)
+        if cached is None:
+            # L2: near-identical query embedding, no ANN search needed
+            if query_embedding is None:
+                query_embedding = self.similarity_search.embed_query(query)
+            cached = self.cache.get_similar(query_embedding)
+
+        if cached is not None and cached[0] >= k:
+            top_contexts = [dict(ctx) for ctx in cached[1][:k]]
+        else:
+            if query_embedding is None:
+                query_embedding = self.similarity_search.embed_query(query)
+            top_contexts = self._search(query_embedding, k)
+            self.cache.put(query, query_embedding, (k, [dict(ctx) for ctx in top_contexts]))
+
+        # NEW: Store similarity scores
+        if store_scores and top_contexts:
+            self._metadata_writer.submit(
+                self._store_scores,
+                query,
+                [ctx['chunk_id'] for ctx in top_contexts],
+                [ctx['similarity_score'] for ctx in top_contexts],
+                [ctx['rank'] for ctx in top_contexts],
+                datetime.now().isoformat()
+            )
+
+        return top_contexts
+
+    def _store_scores(self, query: str, chunk_ids: List[str], scores: List[float], ranks: List[int], timestamp: str):
+        try:
+            self.similarity_search.vector_db.add_retrieval_metadata_batch(
+                chunk_ids=chunk_ids,
+                query=query,
+                similarity_scores=scores,
+                ranks=ranks,
+                retrieval_timestamp=timestamp
+            )
+        except Exception as e:
+            print(f"Warning: Could not store retrieval metadata for {len(chunk_ids)} chunks: {e}")
+
+    def _search(self, query_embedding, k: int) -> List[Dict]:
         initial_results = k * 2
-        results = self.similarity_search.search(query, n_results=initial_results)
+        results = self.similarity_search.search_by_embedding(query_embedding, n_results=initial_results)
 
+        # Chroma returns results ordered by ascending distance, so the first
+        # k are already the best k: slice instead of sorting, and only build
+        # dicts for the contexts that are returned
         contexts = []
-        for i in range(len(results['ids'])):
-            context = {
+        for i in range(min(k, len(results['ids']))):
+            contexts.append({
                 'chunk_id': results['ids'][i],
                 'content': results['documents'][i],  # FIXED
-                'similarity_score': 1 - results['distances'][i],
+                'similarity_score': results['similarities'][i],
                 'metadata': results['metadatas'][i],
                 'rank': i + 1
-            }
-            contexts.append(context)
-
-        contexts.sort(key=lambda x: x['similarity_score'], reverse=True)
-        top_contexts = contexts[:k]
-        # Re-rank after sorting so rank matches the final returned order
-        for new_rank, ctx in enumerate(top_contexts, start=1):
-            ctx["rank"] = new_rank
-
-        # NEW: Store similarity scores
-        if store_scores:
-            vector_db = self.similarity_search.vector_db
-            for ctx in top_contexts:
-                try:
-                    vector_db.add_retrieval_metadata(
-                        chunk_id=ctx['chunk_id'],
-                        query=query,
-                        similarity_score=ctx['similarity_score'],
-                        rank=ctx['rank']
-                    )
-                except Exception as e:
-                    print(f"Warning: Could not store metadata for {ctx['chunk_id']}: {e}")
-
-        return top_contexts
+            })
 
+        return contexts
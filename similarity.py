@@ -2,11 +2,293 @@
 Similarity Search Module - KREPS Project
 Searches vector database for similar chunks
 """
-from typing import Dict
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
 from vdb import VectorDatabase
 from embedding import VectorEmbeddingModule
 
 
+class BruteForceSearch:
+    """
+    Exact cosine search over an in-memory copy of the collection's embeddings.
+
+    For small collections one matrix-vector product against a contiguous,
+    row-normalized float32 matrix is cheaper than an HNSW query and returns
+    exact neighbours. The matrix is loaded from ChromaDB once and then kept
+    in sync through the database's write listeners; it is only reloaded
+    when the database changes in a way it was not told about (e.g. a reset).
+
+    With quantize=True the copy is kept as int8 codes with one scale per row
+    (a quarter of the memory). Candidates are scored on the codes block by
+    block, and the best ones are rescored with their float32 embeddings.
+    """
+
+    # Rows dequantized at a time when scoring int8 codes
+    BLOCK_ROWS = 2048
+
+    def __init__(
+            self,
+            vector_db: VectorDatabase,
+            max_chunks: int = 50_000,
+            quantize: bool = False,
+            rescore_factor: int = 4
+    ):
+        """
+        Initialize brute-force search.
+
+        Args:
+            vector_db: VectorDatabase instance
+            max_chunks: Collections with this many chunks or more are left to ChromaDB
+            quantize: Keep int8 codes instead of float32 vectors in memory
+            rescore_factor: With quantize, n_results * rescore_factor candidates
+                (at least 20) are rescored exactly
+        """
+        self.vector_db = vector_db
+        self.max_chunks = max_chunks
+        self.quantize = quantize
+        self.rescore_factor = rescore_factor
+
+        self._ids: List[str] = []
+        # Rows [0, _size) are live; the spare capacity absorbs appends.
+        # float32 rows, or int8 codes when quantize is set
+        self._buffer: Optional[np.ndarray] = None
+        self._scale_buffer: Optional[np.ndarray] = None
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+        vector_db.add_write_listener(self)
+
+    def available(self) -> bool:
+        """Load the corpus matrix if needed and report whether it can serve queries."""
+        with self._lock:
+            version = self.vector_db.write_version
+            if version == self._version:
+                return self._buffer is not None
+
+            # Record the version before reading, so a write racing the load
+            # triggers another reload on the next query
+            self._version = version
+            self._clear()
+
+            if self.vector_db.collection.count() >= self.max_chunks:
+                return False
+
+            ids, embeddings = self.vector_db.get_all_embeddings()
+            self._buffer, self._scale_buffer = self._encode(embeddings)
+            self._ids = ids
+            self._size = len(ids)
+            return True
+
+    def add(self, ids: List[str], embeddings):
+        """Write listener: append newly stored chunks to the matrix."""
+        with self._lock:
+            if not self._in_sync():
+                return
+
+            # A query that reloaded the matrix while the store was still adding
+            # to ChromaDB (before write_version moved) already has some of these rows
+            loaded = set(self._ids)
+            if not loaded.isdisjoint(ids):
+                keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in loaded]
+                ids = [ids[i] for i in keep]
+                embeddings = np.asarray(embeddings)[keep]
+                if not ids:
+                    return
+
+            if self._size + len(ids) >= self.max_chunks:
+                # Grown past the brute-force range; ChromaDB takes over
+                self._clear()
+                return
+
+            rows, scales = self._encode(embeddings)
+            end = self._size + len(ids)
+            if end > len(self._buffer):
+                # Grow geometrically so a stream of small batches stays amortized O(1) per row
+                capacity = min(max(2 * len(self._buffer), end), self.max_chunks)
+                self._buffer = self._grow(self._buffer, capacity, rows.shape[1:])
+                if scales is not None:
+                    self._scale_buffer = self._grow(self._scale_buffer, capacity, ())
+
+            self._buffer[self._size:end] = rows
+            if scales is not None:
+                self._scale_buffer[self._size:end] = scales
+            self._ids.extend(ids)
+            self._size = end
+
+    def remove(self, ids: List[str]):
+        """Write listener: drop deleted chunks from the matrix."""
+        removed = set(ids)
+        with self._lock:
+            if not self._in_sync():
+                return
+
+            keep = np.fromiter((chunk_id not in removed for chunk_id in self._ids), dtype=bool, count=self._size)
+            if keep.all():
+                return
+            # New arrays rather than in-place compaction: searches may hold views of the old ones
+            self._buffer = self._buffer[:self._size][keep]
+            if self._scale_buffer is not None:
+                self._scale_buffer = self._scale_buffer[:self._size][keep]
+            self._ids = [chunk_id for chunk_id, kept in zip(self._ids, keep) if kept]
+            self._size = len(self._ids)
+
+    def mark_stale(self):
+        """Write listener: a notification could not be applied; reload on the next query."""
+        with self._lock:
+            self._version = None
+
+    def _in_sync(self) -> bool:
+        """
+        Accept a write notification only if this copy saw every earlier write
+        (lock held). Otherwise leave the version stale so the next query reloads.
+        """
+        if self._buffer is None or self._version != self.vector_db.write_version - 1:
+            return False
+        self._version = self.vector_db.write_version
+        return True
+
+    def _clear(self):
+        self._ids, self._buffer, self._scale_buffer, self._size = [], None, None, 0
+
+    def _encode(self, embeddings):
+        """Normalized float32 rows, or int8 codes and per-row scales when quantizing."""
+        if len(embeddings) == 0:
+            # Empty collection: the dimension is taken from the first add
+            return np.empty((0, 0), dtype=np.int8 if self.quantize else np.float32), (
+                np.empty(0, dtype=np.float32) if self.quantize else None
+            )
+
+        matrix = self._normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        if not self.quantize:
+            return np.ascontiguousarray(matrix, dtype=np.float32), None
+
+        # Symmetric per-row scalar quantization: row ~= codes * scale
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _grow(self, array: np.ndarray, capacity: int, row_shape: tuple) -> np.ndarray:
+        grown = np.empty((capacity,) + row_shape, dtype=array.dtype)
+        if self._size:
+            grown[:self._size] = array[:self._size]
+        return grown
+
+    def search(self, query_embedding, n_results: int = 14) -> Dict:
+        """
+        Find the n_results chunks closest to the query embedding.
+
+        Returns:
+            Dictionary with search results (ids, documents, distances, similarities, metadatas),
+            with cosine distances like ChromaDB's cosine space
+        """
+        return self.search_many(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1), n_results)[0]
+
+    def search_many(self, query_embeddings, n_results: int = 14) -> List[Dict]:
+        """
+        Find the n_results closest chunks for each of several query embeddings.
+
+        All queries are scored with one matrix product, and the documents
+        and metadata of every hit are fetched with a single ChromaDB call.
+
+        Args:
+            query_embeddings: (N, dim) array of query embeddings
+
+        Returns:
+            One search result dictionary per query, as returned by search
+        """
+        with self._lock:
+            ids, size = self._ids, self._size
+            matrix = self._buffer[:size] if self._buffer is not None else None
+            scales = self._scale_buffer[:size] if self._scale_buffer is not None else None
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        n = min(n_results, size)
+        if matrix is None or n == 0:
+            return [
+                {"ids": [], "documents": [], "distances": [], "similarities": [], "metadatas": []}
+                for _ in range(len(queries))
+            ]
+
+        queries = self._normalize_rows(queries)
+
+        if scales is None:
+            # Cosine similarity == dot product, since every row is unit length
+            top, top_scores = self._top_k(queries @ matrix.T, n)
+            include = ["documents", "metadatas"]
+        else:
+            candidates = min(size, max(n * self.rescore_factor, 20))
+            top, top_scores = self._top_k(self._quantized_scores(queries, matrix, scales), candidates)
+            include = ["documents", "metadatas", "embeddings"]
+
+        hit_ids = list(dict.fromkeys(ids[i] for i in top.ravel()))
+        data = self.vector_db.collection.get(ids=hit_ids, include=include)
+        position = {chunk_id: i for i, chunk_id in enumerate(data["ids"])}
+
+        if scales is not None:
+            # Exact float32 scores for the candidates, best n kept per query
+            exact = self._normalize_rows(
+                np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+            ) @ queries.T
+
+        results = []
+        for q, (row, row_scores) in enumerate(zip(top, top_scores)):
+            # Chunks deleted since the matrix was loaded are skipped
+            found = [
+                (ids[i], float(score)) for i, score in zip(row, row_scores)
+                if ids[i] in position
+            ]
+            if scales is not None:
+                found = sorted(
+                    ((chunk_id, float(exact[position[chunk_id], q])) for chunk_id, _ in found),
+                    key=lambda hit: -hit[1]
+                )[:n]
+
+            results.append({
+                "ids": [chunk_id for chunk_id, _ in found],
+                "documents": [data["documents"][position[chunk_id]] for chunk_id, _ in found],
+                "distances": [1.0 - score for _, score in found],
+                "similarities": [score for _, score in found],
+                "metadatas": [data["metadatas"][position[chunk_id]] for chunk_id, _ in found]
+            })
+        return results
+
+    def _quantized_scores(self, queries: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        """Approximate cosine scores against int8 codes, dequantizing one block of rows at a time."""
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        block = np.empty((min(self.BLOCK_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), self.BLOCK_ROWS):
+            rows = block[:len(codes[start:start + self.BLOCK_ROWS])]
+            np.copyto(rows, codes[start:start + self.BLOCK_ROWS], casting="unsafe")
+            scores[:, start:start + len(rows)] = queries @ rows.T
+        return scores * scales
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int):
+        """Indices and scores of the k highest scores per row, best first."""
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # BGE-M3 vectors are stored unit length already; skip the N x dim copy
+        if np.allclose(norms, 1.0, atol=1e-4):
+            return matrix
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
 class SimilaritySearch:
     """
     Handles similarity search in vector database.
@@ -15,7 +297,10 @@ class SimilaritySearch:
     def __init__(
             self,
             vector_db: VectorDatabase,
-            embedding_module: VectorEmbeddingModule
+            embedding_module: VectorEmbeddingModule,
+            brute_force_threshold: int = 50_000,
+            query_cache_size: int = 0,
+            quantize_vectors: bool = False
     ):
         """
         Initialize similarity search module.
@@ -23,9 +308,25 @@ class SimilaritySearch:
         Args:
             vector_db: VectorDatabase instance
             embedding_module: VectorEmbeddingModule instance
+            brute_force_threshold: Collections smaller than this are searched
+                exactly in memory instead of through ChromaDB's HNSW index (0 disables)
+            query_cache_size: Number of query embeddings kept in an LRU keyed by
+                the exact query text, so retried and repeated queries skip the
+                encoder (0 disables)
+            quantize_vectors: Keep the in-memory brute-force copy as int8 codes,
+                a quarter of the float32 size, with exact rescoring of the best hits
         """
         self.vector_db = vector_db
         self.embedding_module = embedding_module
+        self.brute_force = BruteForceSearch(
+            vector_db, max_chunks=brute_force_threshold, quantize=quantize_vectors
+        )
+
+        self.query_cache_size = query_cache_size
+        self._query_cache: OrderedDict = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._query_cache_hits = 0
+        self._query_cache_misses = 0
 
     def search(
             self,
@@ -40,15 +341,125 @@ class SimilaritySearch:
             n_results: Number of results to return
 
         Returns:
-            Dictionary with search results (ids, documents, distances, metadatas)
+            Dictionary with search results (ids, documents, distances, similarities, metadatas)
         """
-        # Generate query embedding
-        query_embedding = self.embedding_module.embed_text(query)
+        return self.search_many([query], n_results=n_results)[0]
+
+    def search_many(
+            self,
+            queries: List[str],
+            n_results: int = 14
+    ) -> List[Dict]:
+        """
+        Search for several queries at once (sub-queries, query expansion).
+
+        The queries are embedded in one batched forward pass and searched
+        with one index call.
+
+        Args:
+            queries: User queries
+            n_results: Number of results to return per query
+
+        Returns:
+            One dictionary with search results per query, in the same order
+        """
+        if not queries:
+            return []
+
+        # Generate all query embeddings at once
+        query_embeddings = self._embed_queries(list(queries))
 
         # Search vector database
-        results = self.vector_db.search_similar_chunks(
+        return self.search_many_by_embedding(query_embeddings, n_results=n_results)
+
+    def embed_query(self, query: str):
+        """Generate the embedding for a single query."""
+        return self._embed_queries([query])[0]
+
+    def cache_info(self) -> Dict:
+        """Get size and hit/miss counters of the query embedding cache."""
+        with self._query_cache_lock:
+            return {
+                "hits": self._query_cache_hits,
+                "misses": self._query_cache_misses,
+                "maxsize": self.query_cache_size,
+                "currsize": len(self._query_cache)
+            }
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries, serving repeats from the query cache when it is enabled."""
+        if not self.query_cache_size:
+            return self.embedding_module.embed_text(queries)
+
+        keys = [hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest() for query in queries]
+        vectors: List[Optional[np.ndarray]] = [None] * len(queries)
+        with self._query_cache_lock:
+            for i, key in enumerate(keys):
+                vector = self._query_cache.get(key)
+                if vector is not None:
+                    self._query_cache.move_to_end(key)
+                    vectors[i] = vector
+            hits = sum(vector is not None for vector in vectors)
+            self._query_cache_hits += hits
+            self._query_cache_misses += len(queries) - hits
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embedding_module.embed_text([queries[i] for i in missing])
+            with self._query_cache_lock:
+                for i, vector in zip(missing, embedded):
+                    vector = vector.astype(np.float32, copy=True)
+                    # Cached vectors are shared between callers
+                    vector.setflags(write=False)
+                    vectors[i] = vector
+                    self._query_cache[keys[i]] = vector
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+
+        return np.stack(vectors)
+
+    def search_by_embedding(
+            self,
+            query_embedding,
+            n_results: int = 14
+    ) -> Dict:
+        """
+        Search for similar chunks with an already computed query embedding.
+
+        Args:
+            query_embedding: Query vector embedding
+            n_results: Number of results to return
+
+        Returns:
+            Dictionary with search results (ids, documents, distances, similarities, metadatas)
+        """
+        if self.brute_force.available():
+            return self.brute_force.search(query_embedding, n_results=n_results)
+
+        return self.vector_db.search_similar_chunks(
             query_embedding=query_embedding,
             n_results=n_results
         )
 
-        return results
+    def search_many_by_embedding(
+            self,
+            query_embeddings,
+            n_results: int = 14
+    ) -> List[Dict]:
+        """
+        Search for similar chunks for several already computed query embeddings.
+
+        Args:
+            query_embeddings: (N, dim) array of query embeddings
+            n_results: Number of results to return per query
+
+        Returns:
+            One dictionary with search results per query, in the same order
+        """
+        if self.brute_force.available():
+            return self.brute_force.search_many(query_embeddings, n_results=n_results)
+
+        return self.vector_db.search_similar_chunks_many(
+            query_embeddings=query_embeddings,
+            n_results=n_results
+        )
@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+
+from cache import SemanticCache
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TestSemanticCache(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.cache = SemanticCache(max_size=2, threshold=0.9)
+
+    def test_exact_hit_ignores_case_and_whitespace(self):
+        """Test that L1 matches queries that differ only in case and spacing"""
+        self.cache.put("What is  KREPS?", unit(1, 0), "answer")
+
+        self.assertEqual(self.cache.get("what is kreps?"), "answer")
+        self.assertIsNone(self.cache.get("what is kreps"))
+        self.assertEqual(self.cache.stats()["exact_hits"], 1)
+
+    def test_semantic_hit_respects_threshold(self):
+        """Test that L2 only matches embeddings at or above the threshold"""
+        self.cache.put("first query", unit(1, 0), "answer")
+
+        self.assertEqual(self.cache.get_similar(unit(1, 0.1)), "answer")
+        self.assertIsNone(self.cache.get_similar(unit(1, 1)))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["semantic_hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_eviction_at_capacity(self):
+        """Test that the least recently used entry is evicted when the cache is full"""
+        self.cache.put("a", unit(1, 0, 0), "A")
+        self.cache.put("b", unit(0, 1, 0), "B")
+        self.cache.get("a")
+        self.cache.put("c", unit(0, 0, 1), "C")
+
+        self.assertEqual(self.cache.get("a"), "A")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), "C")
+        self.assertIsNone(self.cache.get_similar(unit(0, 1, 0)))
+        self.assertEqual(self.cache.stats()["size"], 2)
+
+    def test_slot_reuse(self):
+        """Test that replaced and cleared entries free their matrix slots"""
+        self.cache.put("a", unit(1, 0), "old")
+        self.cache.put("a", unit(0, 1), "new")
+
+        self.assertEqual(self.cache.stats()["size"], 1)
+        self.assertEqual(self.cache.get_similar(unit(0, 1)), "new")
+        self.assertIsNone(self.cache.get_similar(unit(1, 0)))
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache._free_slots), 2)
+        self.cache.put("b", unit(1, 0), "B")
+        self.cache.put("c", unit(0, 1), "C")
+        self.assertEqual(self.cache.get_similar(unit(1, 0)), "B")
+        self.assertEqual(self.cache.get_similar(unit(0, 1)), "C")
+
+    def test_zero_size_disables_cache(self):
+        """Test that a cache with max_size=0 stores nothing and never raises"""
+        cache = SemanticCache(max_size=0)
+        cache.put("query", unit(1, 0), "answer")
+
+        self.assertIsNone(cache.get("query"))
+        self.assertIsNone(cache.get_similar(unit(1, 0)))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_expired_entries_are_dropped(self):
+        """Test that entries older than the TTL are not returned"""
+        cache = SemanticCache(max_size=2, ttl_seconds=-1)
+        cache.put("query", unit(1, 0), "answer")
+
+        self.assertIsNone(cache.get("query"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -36,6 +36,18 @@ class TestDocumentIngestion(unittest.TestCase):
         language = self.ingestion._detect_language(text)
         self.assertEqual(language, 'mixed')
 
+    def test_language_detection_no_letters(self):
+        """Test that text without Korean/English letters is not resolved by script ratio"""
+        text = "12345 67890 !!!"
+        language = self.ingestion._detect_language(text)
+        self.assertNotIn(language, ('ko', 'en', 'mixed'))
+
+    def test_clean_text(self):
+        """Test control characters and whitespace cleanup"""
+        text = "  Title\x00\x07  here \t\r\n\n\n\nBody   text  \n"
+        cleaned = self.ingestion._clean_text(text)
+        self.assertEqual(cleaned, "Title here\n\nBody text")
+
     def test_metadata_generation(self):
         """Test metadata counts"""
         documents = []
@@ -0,0 +1,271 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+
+def setUpModule():
+    """Import pipeline, stubbing chunk.py if needed; sys.modules is restored after the module's tests"""
+    global pipeline
+    stubs = mock.patch.dict(sys.modules)
+    stubs.start()
+    unittest.addModuleCleanup(stubs.stop)
+    try:
+        import pipeline
+    except ImportError:
+        # chunk.py needs LangChain; the tests replace its loaders anyway
+        sys.modules["chunk"] = types.ModuleType("chunk")
+        sys.modules["chunk"].process_document = sys.modules["chunk"].process_stream = None
+        import pipeline
+
+
+class FakeEmbedding:
+    """Embedding module returning constant vectors, failing on texts containing fail_on"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.embedded = []
+
+    def embed_documents(self, texts, batch_size=64):
+        if self.fail_on and any(self.fail_on in text for text in texts):
+            raise RuntimeError("encoder failed")
+        self.embedded.extend(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class FakeVectorDB:
+    """Vector database keeping the stored chunk texts per filename"""
+
+    def __init__(self):
+        self.stored = {}
+
+    def store_chunks_with_embeddings(self, chunks, embeddings):
+        for chunk in chunks:
+            self.stored.setdefault(chunk.metadata["filename"], []).append(chunk.page_content)
+        return []
+
+    def get_document_text_hashes(self, filename):
+        return {self.text_hash(text) for text in self.stored.get(filename, [])}
+
+    @staticmethod
+    def text_hash(text):
+        return text
+
+
+class TestIngestionPipeline(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        # filename -> chunk texts, or the exception loading it raises
+        self.documents = {}
+        self.release = {}
+        self.embedding = FakeEmbedding()
+        self.vector_db = FakeVectorDB()
+        self.pipeline = pipeline.IngestionPipeline(self.embedding, self.vector_db, batch_size=2)
+
+        patcher = mock.patch.multiple(pipeline, process_document=self.load_path, process_stream=self.load_stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load_path(self, path, chunk_size, chunk_overlap):
+        """Fake process_document: chunks of self.documents[filename]"""
+        filename = os.path.basename(path)
+        if filename in self.release:
+            self.release[filename].wait(5)
+        texts = self.documents[filename]
+        if isinstance(texts, Exception):
+            raise texts
+        return [SimpleNamespace(page_content=text, metadata={"filename": filename}) for text in texts]
+
+    def load_stream(self, stream, filename, chunk_size, chunk_overlap):
+        """Fake process_stream: same chunks as load_path"""
+        return self.load_path(filename, chunk_size, chunk_overlap)
+
+    def test_status_transitions(self):
+        """Test that a job and its files go from queued/running to completed"""
+        self.documents = {"a.pdf": ["a1", "a2", "a3"], "b.pdf": ["b1"]}
+        self.release["b.pdf"] = threading.Event()
+
+        job_id = self.pipeline.submit(["docs/a.pdf", "docs/b.pdf"])
+        self.wait_for(lambda: self.pipeline.get_job(job_id)["files_processed"] == 1)
+        job = self.pipeline.get_job(job_id)
+        self.assertEqual(job["status"], "running")
+        self.assertEqual(job["file_status"], ["completed", "queued"])
+        self.assertIsNone(job["finished_at"])
+
+        self.release["b.pdf"].set()
+        job = self.pipeline.wait(job_id, timeout=5)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["files"], ["a.pdf", "b.pdf"])
+        self.assertEqual(job["file_status"], ["completed", "completed"])
+        self.assertEqual(job["chunks_created"], 4)
+        self.assertEqual(job["errors"], [])
+        self.assertIsNotNone(job["finished_at"])
+
+    def test_empty_job_is_completed(self):
+        """Test that a job without files is finished immediately"""
+        job = self.pipeline.get_job(self.pipeline.submit([]))
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["file_status"], [])
+
+    def test_unknown_job(self):
+        """Test that unknown job IDs return None"""
+        self.assertIsNone(self.pipeline.get_job("missing"))
+
+    def test_load_failure_is_reported(self):
+        """Test that a file that can't be loaded fails alone and is reported"""
+        self.documents = {"a.pdf": ["a1"], "bad.pdf": OSError("cannot read")}
+
+        job = self.pipeline.run(["a.pdf", "bad.pdf"])
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["file_status"], ["completed", "failed"])
+        self.assertEqual(job["errors"], ["bad.pdf: cannot read"])
+        self.assertEqual(self.vector_db.stored, {"a.pdf": ["a1"]})
+
+    def test_embedding_failure_is_reported(self):
+        """Test that an encoder error fails the file and, with nothing stored, the job"""
+        self.documents = {"a.pdf": ["a1", "broken"]}
+        self.embedding.fail_on = "broken"
+
+        job = self.pipeline.run(["a.pdf"])
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["file_status"], ["failed"])
+        self.assertEqual(job["errors"], ["a.pdf: encoder failed"])
+        self.assertEqual(job["chunks_created"], 0)
+
+    def test_embed_stage_error_fails_job_and_stage_survives(self):
+        """Test that an unexpected error in the embedding stage fails the job and later jobs still run"""
+        self.documents = {"bad.pdf": [None], "a.pdf": ["a1"]}
+
+        job = self.pipeline.wait(self.pipeline.submit(["bad.pdf"]), timeout=5)
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["file_status"], ["failed"])
+        self.assertEqual(len(job["errors"]), 1)
+        self.assertTrue(job["errors"][0].startswith("bad.pdf: "))
+
+        job = self.pipeline.wait(self.pipeline.submit(["a.pdf"]), timeout=5)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["chunks_created"], 1)
+
+    def test_store_stage_error_fails_file_and_stage_survives(self):
+        """Test that an unexpected error in the writer stage fails the file and later jobs still run"""
+        self.documents = {"a.pdf": ["a1"], "b.pdf": ["b1"]}
+
+        with mock.patch.object(self.pipeline, "_release_source", side_effect=RuntimeError("disk full")):
+            job = self.pipeline.wait(self.pipeline.submit(["a.pdf"]), timeout=5)
+        self.assertEqual(job["file_status"], ["failed"])
+        self.assertEqual(job["errors"], ["a.pdf: disk full"])
+
+        job = self.pipeline.wait(self.pipeline.submit(["b.pdf"]), timeout=5)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["file_status"], ["completed"])
+
+    def test_uploads_are_saved_only_when_ingested(self):
+        """Test that uploads are written to persist_dir only if all their chunks were stored"""
+        self.documents = {"a.pdf": ["a1"], "bad.pdf": ValueError("not a PDF")}
+        persist_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, persist_dir)
+        streams = [io.BytesIO(b"good"), io.BytesIO(b"bad")]
+
+        job_id = self.pipeline.submit_uploads(list(zip(["a.pdf", "bad.pdf"], streams)), persist_dir)
+        job = self.pipeline.wait(job_id, timeout=5)
+
+        self.assertEqual(job["file_status"], ["completed", "failed"])
+        self.assertEqual(os.listdir(persist_dir), ["a.pdf"])
+        self.assertTrue(all(stream.closed for stream in streams))
+
+    def test_duplicates_skipped_within_job(self):
+        """Test that chunks repeated within a job (ignoring case and whitespace) are embedded once"""
+        self.documents = {"a.pdf": ["Header", "a1", "header  "], "b.pdf": ["HEADER", "b1"]}
+
+        job = self.pipeline.run(["a.pdf", "b.pdf"])
+        self.assertEqual(job["duplicates_skipped"], 2)
+        self.assertEqual(job["chunks_created"], 3)
+        # Either file may be embedded first, so either spelling of the header can win
+        self.assertEqual(sorted(text.strip().lower() for text in self.embedding.embedded), ["a1", "b1", "header"])
+        self.assertEqual(job["file_status"], ["completed", "completed"])
+
+    def test_duplicates_not_shared_between_jobs(self):
+        """Test that deduplication starts over for every job"""
+        self.documents = {"a.pdf": ["a1"], "b.pdf": ["a1"]}
+
+        self.pipeline.run(["a.pdf"])
+        job = self.pipeline.run(["b.pdf"])
+        self.assertEqual(job["duplicates_skipped"], 0)
+        self.assertEqual(job["chunks_created"], 1)
+
+    def test_deduplicate_disabled(self):
+        """Test that deduplicate=False embeds every chunk"""
+        self.pipeline.deduplicate = False
+        self.documents = {"a.pdf": ["a1", "a1"]}
+
+        job = self.pipeline.run(["a.pdf"])
+        self.assertEqual(job["duplicates_skipped"], 0)
+        self.assertEqual(job["chunks_created"], 2)
+
+    def test_unchanged_chunks_skipped(self):
+        """Test that re-ingesting a file only embeds chunks whose text changed"""
+        self.documents = {"a.pdf": ["a1", "a2"]}
+        self.pipeline.run(["a.pdf"])
+
+        self.documents = {"a.pdf": ["a1", "a2 edited", "a3"]}
+        self.embedding.embedded.clear()
+        job = self.pipeline.run(["a.pdf"])
+
+        self.assertEqual(job["unchanged_skipped"], 1)
+        self.assertEqual(job["chunks_created"], 2)
+        self.assertEqual(sorted(self.embedding.embedded), ["a2 edited", "a3"])
+        self.assertEqual(job["file_status"], ["completed"])
+
+    def test_unchanged_is_per_file(self):
+        """Test that text stored for another file does not count as unchanged"""
+        self.documents = {"a.pdf": ["shared"], "b.pdf": ["shared"]}
+        self.pipeline.run(["a.pdf"])
+
+        job = self.pipeline.run(["b.pdf"])
+        self.assertEqual(job["unchanged_skipped"], 0)
+        self.assertEqual(self.vector_db.stored["b.pdf"], ["shared"])
+
+    def test_fully_unchanged_file_completes(self):
+        """Test that a file with nothing new completes without embedding anything"""
+        self.documents = {"a.pdf": ["a1"]}
+        self.pipeline.run(["a.pdf"])
+        self.embedding.embedded.clear()
+
+        job = self.pipeline.run(["a.pdf"])
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["unchanged_skipped"], 1)
+        self.assertEqual(job["chunks_created"], 0)
+        self.assertEqual(self.embedding.embedded, [])
+
+    def test_unreadable_hashes_embed_everything(self):
+        """Test that a failing stored-hash lookup falls back to embedding every chunk"""
+        self.documents = {"a.pdf": ["a1"]}
+        self.pipeline.run(["a.pdf"])
+
+        with mock.patch.object(self.vector_db, "get_document_text_hashes", side_effect=RuntimeError("db down")):
+            job = self.pipeline.run(["a.pdf"])
+        self.assertEqual(job["unchanged_skipped"], 0)
+        self.assertEqual(job["chunks_created"], 1)
+        self.assertEqual(job["errors"], [])
+
+    def wait_for(self, condition, timeout=5.0):
+        """Poll until condition() holds"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
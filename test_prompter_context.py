@@ -0,0 +1,166 @@
+import unittest
+
+from prompter import PrompterModule
+
+
+def make_chunk(filename, chunk_index, content, score=0.5):
+    return {
+        'chunk_id': f"{filename}-{chunk_index}",
+        'content': content,
+        'metadata': {'filename': filename, 'chunk_index': chunk_index},
+        'similarity_score': score
+    }
+
+
+def entries(context):
+    return [line for line in context.splitlines() if line.startswith('[')]
+
+
+class FakeTokenizer:
+    """One token per character, like a HuggingFace tokenizer's input_ids"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def __call__(self, texts, add_special_tokens=False):
+        if self.fail:
+            raise RuntimeError("tokenizer failed")
+        return {"input_ids": [list(text) for text in texts]}
+
+
+class TestContextCutoff(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.prompter = PrompterModule(max_context_tokens=100, tokenizer_name=None)
+        self.chunks = [make_chunk("doc.pdf", i, "word " * 30, 0.9 - i * 0.1) for i in range(5)]
+
+    def part_tokens(self, prompter, chunks):
+        """Token count of each context entry, numbered in relevance order"""
+        return prompter._count_tokens(
+            [f"[{n}] {prompter._chunk_body(chunk)}" for n, chunk in enumerate(chunks, 1)]
+        )
+
+    def expected_count(self, prompter, chunks):
+        """Longest prefix of the ranking within the budget, counted with a plain loop"""
+        total = 0
+        for count, tokens in enumerate(self.part_tokens(prompter, chunks)):
+            total += tokens
+            if total > prompter.max_context_tokens:
+                return count
+        return len(chunks)
+
+    def test_cutoff_matches_running_total(self):
+        """Test that the cutoff keeps the longest prefix whose running total fits the budget"""
+        for budget in (0, 30, 31, 62, 100, 1000):
+            prompter = PrompterModule(max_context_tokens=budget, tokenizer_name=None)
+            with self.subTest(budget=budget):
+                self.assertEqual(
+                    len(entries(prompter.format_context(self.chunks))),
+                    self.expected_count(prompter, self.chunks)
+                )
+
+    def test_budget_boundary_is_inclusive(self):
+        """Test that entries adding up to exactly the budget are all kept"""
+        tokens = self.part_tokens(self.prompter, self.chunks)
+        prompter = PrompterModule(max_context_tokens=sum(tokens[:3]), tokenizer_name=None)
+        self.assertEqual(len(entries(prompter.format_context(self.chunks))), 3)
+
+        prompter.max_context_tokens -= 1
+        prompter._context_cache.clear()
+        self.assertEqual(len(entries(prompter.format_context(self.chunks))), 2)
+
+    def test_cutoff_stops_at_first_overflow(self):
+        """Test that a short chunk ranked after an oversized one is not used"""
+        chunks = [self.chunks[0], make_chunk("big.pdf", 0, "word " * 500), make_chunk("doc.pdf", 9, "short")]
+        context = self.prompter.format_context(chunks)
+
+        self.assertEqual(len(entries(context)), 1)
+        self.assertNotIn("short", context)
+
+    def test_empty_chunks(self):
+        """Test that no chunks give an empty context"""
+        self.assertEqual(self.prompter.format_context([]), "")
+
+    def test_tokenizer_counts_are_used(self):
+        """Test that counts come from the tokenizer when one is loaded"""
+        self.prompter.tokenizer = FakeTokenizer()
+        parts = ["[1] abc", "[2] de"]
+        self.assertEqual(self.prompter._count_tokens(parts), [7, 6])
+
+        self.prompter.max_context_tokens = len(f"[1] {self.prompter._chunk_body(self.chunks[0])}")
+        self.assertEqual(len(entries(self.prompter.format_context(self.chunks))), 1)
+
+    def test_tokenizer_failure_falls_back_to_estimate(self):
+        """Test that a failing tokenizer is replaced by the character estimate"""
+        self.prompter.tokenizer = FakeTokenizer(fail=True)
+        text = "word " * 30
+        self.assertEqual(self.prompter._count_tokens([text]), [self.prompter._estimate_tokens(text)])
+
+
+class TestContextOrder(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.prompter = PrompterModule(max_context_tokens=1000, tokenizer_name=None)
+        # Relevance order: b#10, a#2, b#9, a#1
+        self.chunks = [
+            make_chunk("b.pdf", 10, "ten", 0.9),
+            make_chunk("a.pdf", 2, "two", 0.8),
+            make_chunk("b.pdf", 9, "nine", 0.7),
+            make_chunk("a.pdf", 1, "one", 0.6)
+        ]
+
+    def test_entries_in_document_order(self):
+        """Test that entries are sorted by filename and numeric chunk index"""
+        context = self.prompter.format_context(self.chunks)
+        order = [line for line in context.splitlines() if line in ("one", "two", "nine", "ten")]
+        self.assertEqual(order, ["one", "two", "nine", "ten"])
+
+    def test_same_chunks_give_same_context(self):
+        """Test that the context does not depend on the ranking of the same chunks"""
+        self.assertEqual(
+            self.prompter.format_context(self.chunks),
+            PrompterModule(tokenizer_name=None).format_context(self.chunks[::-1])
+        )
+
+    def test_cutoff_uses_relevance_order(self):
+        """Test that the budget keeps the most relevant chunks, not the first in document order"""
+        self.chunks[3]['content'] = "word " * 1000
+        context = self.prompter.format_context(self.chunks)
+
+        self.assertEqual(len(entries(context)), 3)
+        self.assertNotIn("word", context)
+
+    def test_citations_match_sources(self):
+        """Test that citation [n] refers to the n-th returned source"""
+        self.chunks[3]['content'] = "word " * 1000
+        prompt, sources = self.prompter.augment_prompt_with_sources("question?", self.chunks)
+
+        self.assertEqual([source.chunk_id for source in sources], ["a.pdf-2", "b.pdf-9", "b.pdf-10"])
+        for n, source in enumerate(sources, 1):
+            self.assertIn(f"[{n}] Source: {source.filename}\n{source.content}\n", prompt)
+
+    def test_cached_context_keeps_order(self):
+        """Test that a cached context is returned with the matching source order"""
+        self.prompter.augment_prompt_with_sources("first?", self.chunks)
+        prompt, sources = self.prompter.augment_prompt_with_sources("second?", self.chunks[::-1])
+
+        self.assertEqual([source.chunk_id for source in sources], ["a.pdf-1", "a.pdf-2", "b.pdf-9", "b.pdf-10"])
+        self.assertIn("[1] Source: a.pdf\none\n", prompt)
+
+    def test_cached_context_with_tied_positions(self):
+        """Test that sources follow the cached entry order when chunks tie on their position"""
+        tied = [make_chunk("a.pdf", 0, "alpha"), make_chunk("a.pdf", 0, "beta")]
+        tied[1]['chunk_id'] = "a.pdf-0-second-batch"
+
+        first_prompt, first_sources = self.prompter.augment_prompt_with_sources("first?", tied)
+        prompt, sources = self.prompter.augment_prompt_with_sources("second?", tied[::-1])
+
+        self.assertEqual(sources, first_sources)
+        for n, source in enumerate(sources, 1):
+            self.assertIn(f"[{n}] Source: {source.filename}\n{source.content}\n", prompt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+import types
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import fake_chromadb
+
+
+def setUpModule():
+    """Import retrieval against fake ChromaDB (and FlagEmbedding) modules, removed after the module's tests"""
+    global ContextRetrieval
+    stubs = mock.patch.dict(sys.modules, fake_chromadb.modules())
+    stubs.start()
+    unittest.addModuleCleanup(stubs.stop)
+    try:
+        import FlagEmbedding
+    except ImportError:
+        # embedding.py imports the model class at module level; these tests never load it
+        sys.modules["FlagEmbedding"] = types.ModuleType("FlagEmbedding")
+        sys.modules["FlagEmbedding"].BGEM3FlagModel = None
+    from retrieval import ContextRetrieval
+
+
+def query_vector(similarity):
+    """Unit vector with the given cosine similarity to [1, 0]"""
+    return np.array([similarity, np.sqrt(1 - similarity ** 2)], dtype=np.float32)
+
+
+class FakeSimilaritySearch:
+    """Similarity search with fixed query embeddings, returning one chunk per search"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.vector_db = SimpleNamespace(write_version=0)
+        self.searches = 0
+
+    def embed_query(self, query):
+        return self.embeddings[query]
+
+    def search_by_embedding(self, query_embedding, n_results):
+        self.searches += 1
+        return {
+            "ids": [f"chunk_{self.searches}"],
+            "documents": [f"result of search {self.searches}"],
+            "similarities": [0.5],
+            "metadatas": [{}]
+        }
+
+
+class TestRetrievalCache(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.similarity = FakeSimilaritySearch({
+            "revenue in 2023": query_vector(1.0),
+            "revenue in 2024": query_vector(0.95),
+            "revenue in 2023 ?": query_vector(0.995)
+        })
+        self.retrieval = ContextRetrieval(self.similarity, top_k=1)
+
+    def retrieve(self, query):
+        return [context['chunk_id'] for context in self.retrieval.retrieve_context(query, store_scores=False)]
+
+    def test_near_miss_query_is_searched(self):
+        """Test that a query differing in one decisive token is not served from the cache"""
+        first = self.retrieve("revenue in 2023")
+        second = self.retrieve("revenue in 2024")
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.similarity.searches, 2)
+
+    def test_near_duplicate_query_is_cached(self):
+        """Test that a query embedding at or above the threshold reuses the cached chunks"""
+        first = self.retrieve("revenue in 2023")
+
+        self.assertEqual(self.retrieve("revenue in 2023 ?"), first)
+        self.assertEqual(self.similarity.searches, 1)
+
+    def test_write_clears_cache(self):
+        """Test that a new write_version invalidates cached results"""
+        self.retrieve("revenue in 2023")
+        self.similarity.vector_db.write_version += 1
+
+        self.retrieve("revenue in 2023")
+        self.assertEqual(self.similarity.searches, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
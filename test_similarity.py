@@ -0,0 +1,172 @@
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import fake_chromadb
+from test_vdb import make_chunks, random_embeddings
+
+
+def setUpModule():
+    """Import similarity against fake ChromaDB (and FlagEmbedding) modules, removed after the module's tests"""
+    global BruteForceSearch, VectorDatabase
+    stubs = mock.patch.dict(sys.modules, fake_chromadb.modules())
+    stubs.start()
+    unittest.addModuleCleanup(stubs.stop)
+    try:
+        import FlagEmbedding
+    except ImportError:
+        # embedding.py imports the model class at module level; these tests never load it
+        sys.modules["FlagEmbedding"] = types.ModuleType("FlagEmbedding")
+        sys.modules["FlagEmbedding"].BGEM3FlagModel = None
+    from similarity import BruteForceSearch
+    from vdb import VectorDatabase
+
+
+class TestBruteForceSync(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory)
+        self.search = BruteForceSearch(self.db, max_chunks=100)
+        self.assertTrue(self.search.available())
+
+    def assert_matches_reload(self, query):
+        """Check the incrementally maintained matrix against a freshly loaded one"""
+        fresh = BruteForceSearch(self.db, max_chunks=100)
+        self.assertTrue(fresh.available())
+        self.assertEqual(self.search.search(query, 5)["ids"], fresh.search(query, 5)["ids"])
+
+    def test_add_is_applied_without_reload(self):
+        """Test that stored chunks are appended to the matrix by the write listener"""
+        embeddings = random_embeddings(12)
+        chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 7), embeddings[:7])
+        chunk_ids += self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 5), embeddings[7:])
+
+        self.assertEqual(self.search._version, self.db.write_version)
+        self.assertEqual(self.search._ids, chunk_ids)
+        self.assertEqual(self.search.search(embeddings[3], 1)["ids"], [chunk_ids[3]])
+        self.assert_matches_reload(embeddings[3])
+
+    def test_remove_is_applied_without_reload(self):
+        """Test that deleted chunks are dropped from the matrix by the write listener"""
+        embeddings = random_embeddings(6)
+        chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 6), embeddings)
+        self.db.delete_chunks(chunk_ids[:2])
+
+        self.assertEqual(self.search._version, self.db.write_version)
+        self.assertEqual(self.search._ids, chunk_ids[2:])
+        self.assertNotIn(chunk_ids[0], self.search.search(embeddings[0], 4)["ids"])
+        self.assert_matches_reload(embeddings[0])
+
+    def test_reload_after_reset(self):
+        """Test that a reset, which notifies no listener, makes the next query reload"""
+        self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 3), random_embeddings(3))
+        self.db.reset_database()
+
+        self.assertTrue(self.search.available())
+        self.assertEqual(self.search._ids, [])
+
+    def test_reload_after_write_by_other_process(self):
+        """Test that a write through another instance on the same directory triggers a reload"""
+        embeddings = random_embeddings(4)
+        other = VectorDatabase(persist_directory=self.directory)
+        chunk_ids = other.store_chunks_with_embeddings(make_chunks("a.pdf", 4), embeddings)
+
+        self.assertEqual(self.search._ids, [])
+        self.assertTrue(self.search.available())
+        self.assertEqual(self.search._ids, chunk_ids)
+        self.assertEqual(self.search.search(embeddings[2], 1)["ids"], [chunk_ids[2]])
+
+    def test_failing_listener_marks_stale(self):
+        """Test that a listener error leaves the copy stale instead of failing the write"""
+        self.search._encode = None
+        chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 2), random_embeddings(2))
+        del self.search._encode
+
+        self.assertIsNone(self.search._version)
+        self.assertTrue(self.search.available())
+        self.assertEqual(self.search._ids, chunk_ids)
+
+    def test_add_skips_rows_loaded_during_store(self):
+        """Test that a reload racing a store does not append the stored rows twice"""
+        self.search.mark_stale()
+        add = self.db.collection.add
+
+        def add_then_query(**kwargs):
+            add(**kwargs)
+            # A query between ChromaDB's add and the write_version bump
+            self.assertTrue(self.search.available())
+
+        self.db.collection.add = add_then_query
+        embeddings = random_embeddings(3)
+        chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 3), embeddings)
+
+        self.assertEqual(self.search._ids, chunk_ids)
+        self.assertEqual(self.search.search(embeddings[0], 3)["ids"][0], chunk_ids[0])
+        self.assertEqual(len(set(self.search.search(embeddings[0], 3)["ids"])), 3)
+
+    def test_falls_back_above_max_chunks(self):
+        """Test that collections at max_chunks are left to ChromaDB"""
+        search = BruteForceSearch(self.db, max_chunks=5)
+        self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 5), random_embeddings(5))
+
+        self.assertFalse(search.available())
+
+
+class TestQuantizedSearch(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory)
+        self.embeddings = random_embeddings(300, dim=64)
+        self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 300), self.embeddings)
+        self.queries = random_embeddings(10, dim=64, seed=1)
+
+        self.exact = BruteForceSearch(self.db, max_chunks=1000)
+        self.quantized = BruteForceSearch(self.db, max_chunks=1000, quantize=True)
+        self.assertTrue(self.exact.available())
+        self.assertTrue(self.quantized.available())
+
+    def test_codes_are_int8(self):
+        """Test that the quantized copy keeps int8 codes and one scale per row"""
+        self.assertEqual(self.quantized._buffer.dtype, np.int8)
+        self.assertEqual(self.quantized._scale_buffer.shape, (300,))
+
+    def test_top_k_matches_float32(self):
+        """Test that rescored int8 search returns the float32 top-k with float32 scores"""
+        expected = self.exact.search_many(self.queries, n_results=10)
+        actual = self.quantized.search_many(self.queries, n_results=10)
+
+        for exact, quantized in zip(expected, actual):
+            self.assertEqual(quantized["ids"], exact["ids"])
+            np.testing.assert_allclose(quantized["similarities"], exact["similarities"], rtol=1e-5)
+
+    def test_top_k_matches_float32_across_blocks(self):
+        """Test that scoring the codes block by block gives the same result"""
+        self.quantized.BLOCK_ROWS = 64
+        expected = self.exact.search_many(self.queries, n_results=5)
+        actual = self.quantized.search_many(self.queries, n_results=5)
+
+        self.assertEqual([result["ids"] for result in actual], [result["ids"] for result in expected])
+
+    def test_incremental_add_matches_float32(self):
+        """Test that rows appended by the write listener are quantized like loaded ones"""
+        extra = random_embeddings(20, dim=64, seed=2)
+        self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 20), extra)
+
+        self.assertEqual(self.quantized._size, 320)
+        for query in extra[:5]:
+            self.assertEqual(self.quantized.search(query, 5)["ids"], self.exact.search(query, 5)["ids"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import fake_chromadb
+
+
+def setUpModule():
+    """Import vdb against the fake ChromaDB, removing both again after the module's tests"""
+    global Float16VectorFile, VectorDatabase
+    stubs = mock.patch.dict(sys.modules, fake_chromadb.modules())
+    stubs.start()
+    unittest.addModuleCleanup(stubs.stop)
+    from vdb import Float16VectorFile, VectorDatabase
+
+
+def make_chunks(filename, count):
+    return [SimpleNamespace(page_content=f"{filename} chunk {i}", metadata={"filename": filename}) for i in range(count)]
+
+
+def random_embeddings(count, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def fake_faiss():
+    """faiss module whose IVF-PQ index searches exactly, for tests of the index bookkeeping"""
+    faiss = types.ModuleType("faiss")
+    faiss.METRIC_INNER_PRODUCT = 0
+
+    def normalize_l2(vectors):
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    class IndexIVFPQ:
+        def __init__(self, quantizer, dim, nlist, m, nbits, metric):
+            self.vectors = {}
+
+        def train(self, sample):
+            pass
+
+        def add_with_ids(self, vectors, labels):
+            self.vectors.update(zip(labels.tolist(), vectors))
+
+        def remove_ids(self, labels):
+            for label in labels.tolist():
+                del self.vectors[label]
+
+        def search(self, queries, k):
+            labels = np.array(list(self.vectors), dtype=np.int64)
+            scores = queries @ np.stack(list(self.vectors.values())).T
+            order = np.argsort(-scores, axis=1)[:, :k]
+            return np.take_along_axis(scores, order, axis=1), labels[order]
+
+    faiss.normalize_L2 = normalize_l2
+    faiss.IndexFlatIP = lambda dim: None
+    faiss.IndexIVFPQ = IndexIVFPQ
+    return faiss
+
+
+class TestFileIndexJournal(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory)
+        self.a_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 3), random_embeddings(3))
+        self.b_ids = self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 2), random_embeddings(2, seed=1))
+
+    def test_replay_in_new_instance(self):
+        """Test that another instance replays the journal written by the first"""
+        other = VectorDatabase(persist_directory=self.directory)
+        self.assertEqual(other._document_chunk_ids("a.pdf"), self.a_ids)
+        self.assertEqual(other._document_chunk_ids("b.pdf"), self.b_ids)
+
+    def test_replay_after_delete(self):
+        """Test that deletes made by one instance are replayed by another"""
+        other = VectorDatabase(persist_directory=self.directory)
+
+        self.db.delete_document_chunks("a.pdf")
+        self.db.delete_chunks(self.b_ids[:1])
+
+        for db in (other, VectorDatabase(persist_directory=self.directory)):
+            self.assertEqual(db._document_chunk_ids("a.pdf"), [])
+            self.assertEqual(db._document_chunk_ids("b.pdf"), self.b_ids[1:])
+
+    def test_replay_after_reset(self):
+        """Test that a reset empties the file index of every instance"""
+        other = VectorDatabase(persist_directory=self.directory)
+        other._document_chunk_ids("a.pdf")
+
+        self.db.reset_database()
+        self.assertEqual(other._document_chunk_ids("a.pdf"), [])
+        self.assertEqual(other._document_chunk_ids("b.pdf"), [])
+
+        new_ids = self.db.store_chunks_with_embeddings(make_chunks("c.pdf", 2), random_embeddings(2))
+        self.assertEqual(other._document_chunk_ids("c.pdf"), new_ids)
+        self.assertEqual(VectorDatabase(persist_directory=self.directory)._document_chunk_ids("c.pdf"), new_ids)
+
+    def test_rebuild_without_journal(self):
+        """Test that a missing journal is rebuilt from chunk metadata"""
+        os.remove(os.path.join(self.directory, "file_index.jsonl"))
+
+        db = VectorDatabase(persist_directory=self.directory)
+        self.assertEqual(sorted(db._document_chunk_ids("a.pdf")), sorted(self.a_ids))
+        self.assertEqual(sorted(db._document_chunk_ids("b.pdf")), sorted(self.b_ids))
+
+
+class TestStoreChunks(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory)
+
+    def test_chunk_index_is_document_position(self):
+        """Test that chunk_index comes from the chunker, not the position in the stored batch"""
+        chunks = make_chunks("a.pdf", 4)
+        for i, chunk in enumerate(chunks):
+            chunk.metadata["chunk_index"] = i
+        self.db.store_chunks_with_embeddings(chunks[:2], random_embeddings(2))
+        chunk_ids = self.db.store_chunks_with_embeddings(chunks[2:], random_embeddings(2))
+
+        metadatas = self.db.get_chunks_by_ids(chunk_ids)["metadatas"]
+        self.assertEqual([metadata["chunk_index"] for metadata in metadatas], [2, 3])
+
+    def test_chunk_index_omitted_without_position(self):
+        """Test that chunks without a document position get no chunk_index"""
+        chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 2), random_embeddings(2))
+        metadatas = self.db.get_chunks_by_ids(chunk_ids)["metadatas"]
+        self.assertTrue(all("chunk_index" not in metadata for metadata in metadatas))
+
+
+class TestFilteredSearch(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory)
+        self.embeddings = random_embeddings(50)
+        self.chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 20), self.embeddings[:20])
+        self.chunk_ids += self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 30), self.embeddings[20:])
+        self.queries = random_embeddings(5, seed=1)
+
+    def test_matches_search_over_allowed_chunks(self):
+        """Test that a selective filter returns the exact top-k of the matching chunks only"""
+        allowed = self.embeddings[:20] / np.linalg.norm(self.embeddings[:20], axis=1, keepdims=True)
+        queries = self.queries / np.linalg.norm(self.queries, axis=1, keepdims=True)
+        scores = queries @ allowed.T
+
+        results = self.db.search_similar_chunks_many(self.queries, n_results=5, filter_metadata={"filename": "a.pdf"})
+        for result, row in zip(results, scores):
+            top = np.argsort(-row, kind="stable")[:5]
+            self.assertEqual(result["ids"], [self.chunk_ids[i] for i in top])
+            np.testing.assert_allclose(result["similarities"], row[top], rtol=1e-5)
+            np.testing.assert_allclose(result["distances"], 1.0 - row[top], rtol=1e-5, atol=1e-6)
+            self.assertTrue(all(metadata["filename"] == "a.pdf" for metadata in result["metadatas"]))
+
+    def test_fewer_matches_than_n_results(self):
+        """Test that a filter matching fewer chunks than requested returns all of them, or none"""
+        result = self.db.search_similar_chunks(self.queries[0], n_results=50, filter_metadata={"filename": "a.pdf"})
+        self.assertEqual(sorted(result["ids"]), sorted(self.chunk_ids[:20]))
+
+        result = self.db.search_similar_chunks(self.queries[0], n_results=5, filter_metadata={"filename": "c.pdf"})
+        self.assertEqual(result["ids"], [])
+
+    def test_falls_back_above_limit(self):
+        """Test that a filter matching PREFILTER_MAX_CHUNKS or more chunks is left to the collection query"""
+        self.db.store_chunks_with_embeddings(
+            make_chunks("big.pdf", self.db.PREFILTER_MAX_CHUNKS + 1),
+            random_embeddings(self.db.PREFILTER_MAX_CHUNKS + 1, seed=2)
+        )
+        expected = [{"ids": [], "documents": [], "distances": [], "similarities": [], "metadatas": []}]
+
+        with mock.patch.object(self.db, "_query_collection", return_value=expected) as query, \
+                mock.patch.object(self.db, "_search_chunk_subset") as subset:
+            result = self.db.search_similar_chunks(self.queries[0], n_results=5, filter_metadata={"filename": "big.pdf"})
+
+        self.assertEqual(result, expected[0])
+        query.assert_called_once()
+        queries, n_results, filter_metadata = query.call_args.args
+        np.testing.assert_array_equal(queries, [self.queries[0]])
+        self.assertEqual((n_results, filter_metadata), (5, {"filename": "big.pdf"}))
+        subset.assert_not_called()
+
+
+class TestFaissIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        stubs = mock.patch.dict(sys.modules, {"faiss": fake_faiss()})
+        stubs.start()
+        self.addCleanup(stubs.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = VectorDatabase(persist_directory=self.directory, backend="faiss_ivfpq")
+        self.db.FAISS_MIN_CHUNKS = 10
+        self.embeddings = random_embeddings(20, dim=1024)
+        self.chunk_ids = self.db.store_chunks_with_embeddings(make_chunks("a.pdf", 20), self.embeddings)
+
+    def test_search_uses_index(self):
+        """Test that unfiltered searches go through the FAISS index once it is built"""
+        result = self.db.search_similar_chunks(self.embeddings[4], n_results=3)
+
+        self.assertIsNotNone(self.db._ann_index)
+        self.assertEqual(result["ids"][0], self.chunk_ids[4])
+        self.assertAlmostEqual(result["similarities"][0], 1.0, places=5)
+
+    def test_index_follows_writes(self):
+        """Test that stores and deletes after the build are applied to the index"""
+        self.db.search_similar_chunks(self.embeddings[0])
+        extra = random_embeddings(1, dim=1024, seed=1)
+        new_id = self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 1), extra)[0]
+        self.db.delete_chunks(self.chunk_ids[:1])
+
+        self.assertEqual(self.db.search_similar_chunks(extra[0], n_results=1)["ids"], [new_id])
+        self.assertNotIn(self.chunk_ids[0], self.db.search_similar_chunks(self.embeddings[0], n_results=5)["ids"])
+
+    def test_write_during_build_discards_index(self):
+        """Test that an index built while the collection changed is not published"""
+        extra = random_embeddings(1, dim=1024, seed=1)
+        get = self.db.collection.get
+        stored = []
+
+        def get_then_store(**kwargs):
+            page = get(**kwargs)
+            if not stored:
+                # Another thread stores a chunk while the build pages through the collection
+                stored.extend(self.db.store_chunks_with_embeddings(make_chunks("b.pdf", 1), extra))
+            return page
+
+        with mock.patch.object(self.db.collection, "get", side_effect=get_then_store):
+            self.assertIsNone(self.db._get_ann_index())
+        self.assertIsNone(self.db._ann_index)
+
+        self.assertEqual(self.db.search_similar_chunks(extra[0], n_results=1)["ids"], stored)
+        self.assertIsNotNone(self.db._ann_index)
+
+    def test_notified_chunks_already_in_index_are_skipped(self):
+        """Test that chunks both in the build and in a later add notification are indexed once"""
+        index = self.db._get_ann_index()
+        index.add(self.chunk_ids[:2], self.embeddings[:2])
+
+        self.assertEqual(len(index._ids), 20)
+        result = self.db.search_similar_chunks(self.embeddings[0], n_results=3)
+        self.assertEqual(len(set(result["ids"])), 3)
+
+
+class TestFloat16VectorFile(unittest.TestCase):
+
+    def setUp(self):
+        """Run before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.vector_file = Float16VectorFile(self.directory)
+
+    def test_offsets_round_trip(self):
+        """Test that rows() and mmap() return each vector at its recorded offset"""
+        first = random_embeddings(3)
+        second = random_embeddings(2, seed=1)
+        self.vector_file.add(["a", "b", "c"], first)
+        self.vector_file.add(["d", "e"], second)
+
+        ids, rows = self.vector_file.rows()
+        self.assertEqual(ids, ["a", "b", "c", "d", "e"])
+        np.testing.assert_array_equal(rows, np.arange(5))
+        np.testing.assert_array_equal(
+            self.vector_file.mmap()[rows], np.vstack([first, second]).astype(np.float16)
+        )
+
+    def test_removed_rows_are_skipped(self):
+        """Test that removed IDs lose their offset while the others keep theirs"""
+        embeddings = random_embeddings(4)
+        self.vector_file.add(["a", "b", "c", "d"], embeddings)
+        self.vector_file.remove(["b", "d"])
+
+        ids, rows = self.vector_file.rows()
+        self.assertEqual(ids, ["a", "c"])
+        np.testing.assert_array_equal(self.vector_file.mmap()[rows], embeddings[[0, 2]].astype(np.float16))
+        self.assertEqual(len(self.vector_file.mmap()), 4)
+
+    def test_offsets_survive_reopen(self):
+        """Test that a new instance on the same directory appends after the existing rows"""
+        embeddings = random_embeddings(3)
+        self.vector_file.add(["a", "b"], embeddings[:2])
+        reopened = Float16VectorFile(self.directory)
+        reopened.add(["c"], embeddings[2:])
+
+        ids, rows = reopened.rows()
+        self.assertEqual(ids, ["a", "b", "c"])
+        np.testing.assert_array_equal(reopened.mmap()[rows], embeddings.astype(np.float16))
+
+    def test_dimension_mismatch(self):
+        """Test that vectors of another dimension are rejected without writing"""
+        self.vector_file.add(["a"], random_embeddings(1))
+
+        with self.assertRaises(ValueError):
+            self.vector_file.add(["b"], random_embeddings(1, dim=4))
+        self.assertEqual(self.vector_file.rows()[0], ["a"])
+        self.assertEqual(self.vector_file.mmap().shape, (1, 8))
+
+    def test_clear(self):
+        """Test that clear() drops every row and the stored dimension"""
+        self.vector_file.add(["a"], random_embeddings(1))
+        self.vector_file.clear()
+
+        self.assertEqual(self.vector_file.rows()[0], [])
+        self.assertEqual(len(self.vector_file.mmap()), 0)
+        self.vector_file.add(["b"], random_embeddings(1, dim=4))
+        self.assertEqual(self.vector_file.mmap().shape, (1, 4))
+
+    def test_database_reads_embeddings_from_file(self):
+        """Test that get_all_embeddings serves live chunks from the vector file"""
+        db = VectorDatabase(persist_directory=self.directory, mmap_vectors=True)
+        embeddings = random_embeddings(3)
+        chunk_ids = db.store_chunks_with_embeddings(make_chunks("a.pdf", 3), embeddings)
+        db.delete_chunks(chunk_ids[1:2])
+
+        ids, vectors = db.get_all_embeddings()
+        self.assertEqual(ids, [chunk_ids[0], chunk_ids[2]])
+        # float16 values, so they came from the file rather than the collection
+        np.testing.assert_array_equal(vectors, embeddings[[0, 2]].astype(np.float16).astype(np.float32))
+
+
+if __name__ == '__main__':
+    unittest.main()
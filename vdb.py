@@ -6,11 +6,236 @@ Integrates with Document Ingestion, Chunking, and Vector Embedding modules
 
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Protocol, Tuple, Union
 from pathlib import Path
 import json
+import numpy as np
+import xxhash
 from datetime import datetime
 import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+class VectorIndex(Protocol):
+    """Approximate nearest-neighbour index searched instead of ChromaDB's HNSW graph."""
+
+    def add(self, ids: List[str], embeddings: np.ndarray) -> None: ...
+
+    def remove(self, ids: List[str]) -> None: ...
+
+    def query(self, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, List[List[str]]]: ...
+
+
+class FaissIVFPQIndex:
+    """
+    FAISS IVF-PQ index over cosine similarity.
+
+    Each vector is compressed to m bytes of product-quantization codes
+    (64 bytes instead of 4 KB for 1024-d float32), and queries only scan
+    the nprobe closest of nlist inverted lists. Trades a little recall for
+    much lower memory and latency on collections past ~1M chunks.
+    """
+
+    def __init__(self, dim: int = 1024, m: int = 64, nbits: int = 8, nprobe: int = 16):
+        """
+        Initialize an empty, untrained index.
+
+        Args:
+            dim: Embedding dimension
+            m: Number of PQ sub-quantizers (bytes per vector); must divide dim
+            nbits: Bits per sub-quantizer code
+            nprobe: Inverted lists scanned per query
+        """
+        import faiss
+
+        self._faiss = faiss
+        self.dim = dim
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+
+        self._index = None
+        # FAISS labels are int64 positions into _ids; removed slots become None
+        self._ids: List[Optional[str]] = []
+        self._labels: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_trained(self) -> bool:
+        return self._index is not None
+
+    def train(self, embeddings: np.ndarray):
+        """Train the coarse quantizer (nlist = sqrt(N)) and PQ codebooks on a sample."""
+        faiss = self._faiss
+        sample = self._prepare(embeddings)
+        nlist = max(1, int(np.sqrt(len(sample))))
+
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFPQ(quantizer, self.dim, nlist, self.m, self.nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(sample)
+        index.nprobe = min(self.nprobe, nlist)
+
+        with self._lock:
+            # The quantizer must outlive the Python wrapper that owns it
+            self._quantizer = quantizer
+            self._index = index
+
+    def add(self, ids: List[str], embeddings: np.ndarray):
+        vectors = self._prepare(embeddings)
+        with self._lock:
+            # Chunks stored while the index was being built can be both in the
+            # build and in the write notification that follows it
+            if any(chunk_id in self._labels for chunk_id in ids):
+                keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._labels]
+                ids, vectors = [ids[i] for i in keep], vectors[keep]
+                if not ids:
+                    return
+            start = len(self._ids)
+            labels = np.arange(start, start + len(ids), dtype=np.int64)
+            self._ids.extend(ids)
+            self._labels.update(zip(ids, range(start, start + len(ids))))
+            self._index.add_with_ids(vectors, labels)
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            labels = [self._labels.pop(chunk_id) for chunk_id in ids if chunk_id in self._labels]
+            if not labels:
+                return
+            for label in labels:
+                self._ids[label] = None
+            self._index.remove_ids(np.asarray(labels, dtype=np.int64))
+
+    def query(self, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, List[List[str]]]:
+        """Return (similarities, ids) of the k best chunks per query, best first."""
+        queries = self._prepare(embeddings)
+        with self._lock:
+            scores, labels = self._index.search(queries, k)
+            ids = [[self._ids[label] for label in row if label >= 0] for row in labels]
+        return scores, ids
+
+    def _prepare(self, embeddings) -> np.ndarray:
+        """Contiguous, L2-normalized float32 rows, so inner product equals cosine similarity."""
+        vectors = np.array(embeddings, dtype=np.float32, order="C").reshape(-1, self.dim)
+        self._faiss.normalize_L2(vectors)
+        return vectors
+
+
+class Float16VectorFile:
+    """
+    Append-only float16 copy of the stored embeddings, memory-mapped for scans.
+
+    vectors.f16.bin holds one row per stored chunk and the vector_offsets
+    table in vectors.sqlite3 maps chunk IDs to rows. Reading every vector
+    back is then a sequential read of 2 bytes per dimension instead of a
+    SQLite round trip through Python lists. Deleted chunks lose their
+    offset but keep their bytes until the file is cleared.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "vectors.f16.bin")
+        self.db_path = os.path.join(directory, "vectors.sqlite3")
+
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS vector_offsets (chunk_id TEXT PRIMARY KEY, row_index INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS vector_file (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; writers take an explicit IMMEDIATE lock so
+        # appends from several processes get distinct rows
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _dim(conn: sqlite3.Connection) -> Optional[int]:
+        row = conn.execute("SELECT value FROM vector_file WHERE key = 'dim'").fetchone()
+        return row[0] if row else None
+
+    def add(self, ids: List[str], embeddings):
+        """Append embeddings and record their rows (also used as a write listener)."""
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float16).reshape(len(ids), -1)
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            dim = self._dim(conn)
+            if dim is None:
+                dim = vectors.shape[1]
+                conn.execute("INSERT INTO vector_file VALUES ('dim', ?)", (dim,))
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match vector file dimension {dim}")
+
+            # Whole rows only: bytes from an interrupted append are overwritten
+            row_bytes = dim * vectors.itemsize
+            start = (os.path.getsize(self.path) if os.path.exists(self.path) else 0) // row_bytes
+            with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+                f.seek(start * row_bytes)
+                f.write(vectors.tobytes())
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO vector_offsets VALUES (?, ?)",
+                zip(ids, range(start, start + len(ids)))
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def remove(self, ids: List[str]):
+        """Forget the rows of deleted chunks (also used as a write listener)."""
+        conn = self._connect()
+        try:
+            conn.executemany("DELETE FROM vector_offsets WHERE chunk_id = ?", ((chunk_id,) for chunk_id in ids))
+        finally:
+            conn.close()
+
+    def clear(self):
+        """Drop every vector."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM vector_offsets")
+            conn.execute("DELETE FROM vector_file")
+            if os.path.exists(self.path):
+                os.truncate(self.path, 0)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def rows(self) -> Tuple[List[str], np.ndarray]:
+        """IDs of the live chunks and their row indices, in file order."""
+        conn = self._connect()
+        try:
+            pairs = conn.execute("SELECT chunk_id, row_index FROM vector_offsets ORDER BY row_index").fetchall()
+        finally:
+            conn.close()
+        return [chunk_id for chunk_id, _ in pairs], np.fromiter((row for _, row in pairs), dtype=np.int64, count=len(pairs))
+
+    def mmap(self) -> np.ndarray:
+        """Read-only (rows, dim) float16 memmap of the file, including rows of deleted chunks."""
+        conn = self._connect()
+        try:
+            dim = self._dim(conn)
+        finally:
+            conn.close()
+
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if dim is None or size < dim * 2:
+            return np.empty((0, dim or 0), dtype=np.float16)
+        return np.memmap(self.path, dtype=np.float16, mode="r", shape=(size // (dim * 2), dim))
 
 
 class VectorDatabase:
@@ -19,11 +244,25 @@ class VectorDatabase:
     their embeddings, and metadata from the entire pipeline.
     """
 
+    # Chunks sent to ChromaDB per add() call; bounds the size of each request
+    ADD_BATCH_SIZE = 256
+    # Filters matching fewer chunks than this are searched exactly in memory
+    PREFILTER_MAX_CHUNKS = 1024
+    # The FAISS backend is only built once the collection is this large;
+    # smaller collections are served by ChromaDB
+    FAISS_MIN_CHUNKS = 100_000
+    # Vectors used to train the IVF-PQ quantizers
+    FAISS_TRAIN_SIZE = 100_000
+    # Larger multi-query searches are split into groups of this size and run concurrently
+    QUERY_GROUP_SIZE = 16
+
     def __init__(
             self,
             collection_name: str = "kreps_documents",
-            persist_directory: str = os.path.join(os.path.dirname(__file__), "chroma_db")
-
+            persist_directory: str = os.path.join(os.path.dirname(__file__), "chroma_db"),
+            session_id: Optional[str] = None,
+            backend: str = "chroma",
+            mmap_vectors: bool = False
     ):
         """
         Initialize ChromaDB vector database.
@@ -31,9 +270,20 @@ class VectorDatabase:
         Args:
             collection_name: Name of the ChromaDB collection
             persist_directory: Directory to persist the database
+            session_id: If set, stored chunks are tagged with it so they can be
+                removed together with delete_session_chunks
+            backend: "chroma" to search with ChromaDB's HNSW index, or "faiss_ivfpq"
+                to search unfiltered queries with a FAISS IVF-PQ index (requires faiss)
+            mmap_vectors: Also keep a memory-mapped float16 copy of the embeddings
+                (vectors.f16.bin), so full scans need not read them back from ChromaDB
         """
+        if backend not in ("chroma", "faiss_ivfpq"):
+            raise ValueError(f"Unknown backend: {backend}")
+
         self.collection_name = collection_name
         self.persist_directory = persist_directory
+        self.session_id = session_id
+        self.backend = backend
 
         # Initialize ChromaDB client with persistent storage
         self.client = chromadb.PersistentClient(
@@ -47,10 +297,112 @@ class VectorDatabase:
         # Get or create collection
         self.collection = self._get_or_create_collection()
 
+        # Bumped on every write that can change search results, so query
+        # caches can tell when their entries are stale (see write_version).
+        # The write stamp file counts writes of every process sharing the
+        # persist directory, e.g. all gunicorn workers.
+        self._write_version = 0
+        self._version_lock = threading.Lock()
+        self._stamp_path = os.path.join(persist_directory, "write_stamp")
+        self._stamp_seen = self._read_stamp()
+        self._stamp_stat = None
+
+        # Sequence number of the next stored chunk, reconciled with the
+        # collection once here instead of a count() query on every store
+        self._chunk_counter = self.collection.count()
+        self._chunk_counter_lock = threading.Lock()
+
+        # filename -> chunk IDs, so per-document lookups and deletes are
+        # primary-key operations instead of metadata scans. Persisted as an
+        # append-only JSON-lines journal that every process replays.
+        self._file_index: Dict[str, List[str]] = {}
+        self._file_index_path = os.path.join(persist_directory, "file_index.jsonl")
+        self._file_index_offset = 0
+        self._file_index_inode = None
+        self._file_index_lock = threading.Lock()
+        self._init_file_index()
+
+        # Built from the collection on the first search that needs it
+        self._ann_index: Optional[VectorIndex] = None
+        self._ann_lock = threading.Lock()
+
+        # In-memory copies of the embeddings (see add_write_listener)
+        self._write_listeners: List = []
+
+        self.vector_file = Float16VectorFile(persist_directory) if mmap_vectors else None
+        if self.vector_file is not None:
+            self.add_write_listener(self.vector_file)
+
+        self._query_pool: Optional[ThreadPoolExecutor] = None
+        self._query_pool_pid = None
+        self._query_pool_lock = threading.Lock()
+
         print(f"VectorDatabase initialized")
         print(f"Collection: {collection_name}")
         print(f"Persist directory: {persist_directory}")
 
+    @property
+    def write_version(self) -> int:
+        """
+        Version of the collection's contents in this process.
+
+        Bumped by every store and delete made here (write listeners are then
+        notified), and also when another process sharing the persist directory
+        has written since the last check. Those foreign writes come without a
+        notification, so in-memory copies see a version gap and reload.
+        """
+        self._check_foreign_writes()
+        return self._write_version
+
+    def _read_stamp(self) -> int:
+        try:
+            with open(self._stamp_path, encoding="utf-8") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _check_foreign_writes(self):
+        """Pick up writes made by other processes; one stat() when nothing changed."""
+        try:
+            stat = os.stat(self._stamp_path)
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._stamp_stat:
+            return
+
+        with self._version_lock:
+            self._stamp_stat = key
+            stamp = self._read_stamp()
+            if stamp != self._stamp_seen:
+                self._stamp_seen = stamp
+                self._foreign_write()
+
+    def _foreign_write(self):
+        """Invalidate state derived from the collection after another process wrote (lock held)."""
+        self._write_version += 1
+        # The FAISS index only follows this process's writes; rebuild it on the next search
+        self._ann_index = None
+
+    def _bump_write_version(self):
+        """Record a write made by this process, locally and in the shared write stamp."""
+        with self._version_lock, open(f"{self._stamp_path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            stamp = self._read_stamp()
+            if stamp != self._stamp_seen:
+                self._foreign_write()
+
+            # Replaced atomically, so readers never see a partial number
+            tmp_path = f"{self._stamp_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(str(stamp + 1))
+            os.replace(tmp_path, self._stamp_path)
+
+            self._stamp_seen = stamp + 1
+            self._write_version += 1
+
     def _get_or_create_collection(self):
         """Get existing collection or create new one."""
         try:
@@ -61,10 +413,172 @@ class VectorDatabase:
                 metadata={"hnsw:space": "cosine"}
             )
 
+    def _init_file_index(self):
+        """Load the file index, rebuilding it from chunk metadata if no journal exists yet."""
+        if os.path.exists(self._file_index_path):
+            self._sync_file_index()
+            return
+
+        index: Dict[str, List[str]] = {}
+        if self.collection.count():
+            data = self.collection.get(include=["metadatas"])
+            for chunk_id, metadata in zip(data["ids"], data["metadatas"]):
+                index.setdefault(metadata.get("filename", "unknown"), []).append(chunk_id)
+        self._rewrite_file_index(index)
+
+    def _rewrite_file_index(self, index: Dict[str, List[str]]):
+        """Replace the journal with one entry per file."""
+        tmp_path = f"{self._file_index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(
+                json.dumps({"filename": filename, "add": ids}, ensure_ascii=False) + "\n"
+                for filename, ids in index.items()
+            )
+        os.replace(tmp_path, self._file_index_path)
+
+        with self._file_index_lock:
+            self._file_index_inode = None
+        self._sync_file_index()
+
+    def _append_file_index(self, entries: List[Dict]):
+        """Append entries to the journal and apply them (and any written by other processes)."""
+        with open(self._file_index_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._sync_file_index()
+
+    def _sync_file_index(self):
+        """Replay journal entries written since the last sync."""
+        with self._file_index_lock:
+            try:
+                stat = os.stat(self._file_index_path)
+            except FileNotFoundError:
+                return
+
+            # A rewritten journal is replayed from the start
+            if stat.st_ino != self._file_index_inode or stat.st_size < self._file_index_offset:
+                self._file_index = {}
+                self._file_index_offset = 0
+                self._file_index_inode = stat.st_ino
+            if stat.st_size == self._file_index_offset:
+                return
+
+            with open(self._file_index_path, "rb") as f:
+                f.seek(self._file_index_offset)
+                data = f.read()
+
+            # Stop at the last complete line; a concurrent append may be half written
+            data = data[:data.rfind(b"\n") + 1]
+            self._file_index_offset += len(data)
+
+            for line in data.splitlines():
+                entry = json.loads(line)
+                filename = entry["filename"]
+                if entry.get("drop"):
+                    self._file_index.pop(filename, None)
+                elif "add" in entry:
+                    self._file_index.setdefault(filename, []).extend(entry["add"])
+                elif filename in self._file_index:
+                    removed = set(entry["remove"])
+                    remaining = [chunk_id for chunk_id in self._file_index[filename] if chunk_id not in removed]
+                    if remaining:
+                        self._file_index[filename] = remaining
+                    else:
+                        del self._file_index[filename]
+
+    def _document_chunk_ids(self, filename: str) -> List[str]:
+        """IDs of all chunks stored for a document, from the file index."""
+        self._sync_file_index()
+        with self._file_index_lock:
+            return list(self._file_index.get(filename, []))
+
+    def add_write_listener(self, listener):
+        """
+        Register an object with add(ids, embeddings) and remove(ids) methods,
+        called after every store and delete with write_version already bumped,
+        so in-memory copies of the embeddings can be updated instead of reloaded.
+        If a listener raises, its optional mark_stale() method is called.
+        """
+        self._write_listeners.append(listener)
+
+    def mmap_matrix(self) -> np.ndarray:
+        """
+        Memory-mapped float16 matrix of every vector written to the vector file.
+
+        Rows of deleted chunks are still present; use get_all_embeddings or
+        vector_file.rows() to select the live ones.
+        """
+        if self.vector_file is None:
+            raise RuntimeError("VectorDatabase was created without mmap_vectors=True")
+        return self.vector_file.mmap()
+
+    def get_all_embeddings(self) -> Tuple[List[str], np.ndarray]:
+        """
+        IDs and float32 embeddings of every stored chunk.
+
+        Read from the float16 vector file when it covers the whole
+        collection, otherwise from ChromaDB.
+        """
+        if self.vector_file is not None:
+            ids, rows = self.vector_file.rows()
+            if ids and len(ids) == self.collection.count():
+                return ids, self.vector_file.mmap()[rows].astype(np.float32)
+
+        data = self.collection.get(include=["embeddings"])
+        if not data["ids"]:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return list(data["ids"]), np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+
+    def _notify_listeners(self, method: str, *args):
+        """
+        Forward a write to every listener. A failing listener is logged and
+        marked stale instead of failing the write, which ChromaDB already holds.
+        """
+        listeners = list(self._write_listeners)
+        if self._ann_index is not None:
+            listeners.append(self._ann_index)
+        for listener in listeners:
+            try:
+                getattr(listener, method)(*args)
+            except Exception as e:
+                print(f"Warning: {type(listener).__name__}.{method} failed, marking it stale: {e}")
+                if listener is self._ann_index:
+                    # Rebuilt from the collection on the next search
+                    self._ann_index = None
+                elif hasattr(listener, "mark_stale"):
+                    listener.mark_stale()
+
+    def _remove_from_indexes(self, chunk_ids: List[str]):
+        """Record deleted chunks in the file index and notify listeners."""
+        removed = set(chunk_ids)
+        self._sync_file_index()
+        with self._file_index_lock:
+            entries = []
+            for filename, ids in self._file_index.items():
+                hits = [chunk_id for chunk_id in ids if chunk_id in removed]
+                if hits:
+                    entries.append({"filename": filename, "remove": hits})
+        if entries:
+            self._append_file_index(entries)
+
+        self._notify_listeners("remove", chunk_ids)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Hash of a chunk's exact text, stored as its text_hash metadata."""
+        return xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+
+    def get_document_text_hashes(self, filename: str) -> set:
+        """text_hash values of the chunks stored for a document (chunks stored without one are ignored)."""
+        chunk_ids = self._document_chunk_ids(filename)
+        if not chunk_ids:
+            return set()
+        metadatas = self.collection.get(ids=chunk_ids, include=["metadatas"])["metadatas"]
+        return {metadata["text_hash"] for metadata in metadatas if "text_hash" in metadata}
+
     def store_chunks_with_embeddings(
             self,
             chunks: List,
-            embeddings: List[List[float]],
+            embeddings: Union[np.ndarray, List[List[float]]],
             document_metadata: Dict = None
     ) -> List[str]:
         """
@@ -72,57 +586,77 @@ class VectorDatabase:
 
         Args:
             chunks: List of LangChain Document chunks with metadata
-            embeddings: List of embedding vectors (from embedding module)
+            embeddings: (N, dim) float32 array from the embedding module, or a list of vectors
             document_metadata: Original document metadata from ingestion module
 
         Returns:
             List of chunk IDs stored in the database
         """
-        if not chunks or not embeddings:
+        if not chunks or len(embeddings) == 0:
             raise ValueError("Chunks and embeddings cannot be empty")
 
         if len(chunks) != len(embeddings):
             raise ValueError(f"Mismatch: {len(chunks)} chunks but {len(embeddings)} embeddings")
 
-        chunk_ids = []
-        chunk_texts = []
-        chunk_metadatas = []
-
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            chunk_id = f"chunk_{self.collection.count() + i}_{int(datetime.now().timestamp())}"
-            chunk_ids.append(chunk_id)
+        # Invariant for the whole call: one clock read and one random batch
+        # tag that keeps IDs unique across calls and processes
+        with self._chunk_counter_lock:
+            base = self._chunk_counter
+            self._chunk_counter += len(chunks)
+        now = datetime.now()
+        batch = uuid.uuid4().hex[:12]
 
-            chunk_texts.append(chunk.page_content)
+        base_metadata = {"ingestion_timestamp": now.isoformat()}
+        if self.session_id:
+            base_metadata["session_id"] = self.session_id
+        if document_metadata:
+            base_metadata.update({
+                "doc_language": document_metadata.get('languages', {}),
+                "total_documents": document_metadata.get('total_documents', 0)
+            })
 
-            metadata = {
+        chunk_ids = [f"chunk_{base + i}_{batch}" for i in range(len(chunks))]
+        chunk_texts = [chunk.page_content for chunk in chunks]
+        chunk_metadatas = [
+            {
                 "filename": chunk.metadata.get('filename', 'unknown'),
                 "page": chunk.metadata.get('page', 0),
-                "chunk_index": i,
+                # Position in the document, set by the chunker (the batch position
+                # would repeat across the batches of one document)
+                **({"chunk_index": chunk.metadata["chunk_index"]} if "chunk_index" in chunk.metadata else {}),
                 "chunk_length": len(chunk.page_content),
-                "ingestion_timestamp": datetime.now().isoformat(),
+                "text_hash": self.text_hash(chunk.page_content),
+                **base_metadata
             }
+            for chunk in chunks
+        ]
 
-            if document_metadata:
-                metadata.update({
-                    "doc_language": document_metadata.get('languages', {}),
-                    "total_documents": document_metadata.get('total_documents', 0)
-                })
-
-            chunk_metadatas.append(metadata)
+        # Stream to ChromaDB in micro-batches: slices of the embedding array
+        # are views, so only one batch is converted and in flight at a time
+        for start in range(0, len(chunk_ids), self.ADD_BATCH_SIZE):
+            end = start + self.ADD_BATCH_SIZE
+            self.collection.add(
+                ids=chunk_ids[start:end],
+                documents=chunk_texts[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=chunk_metadatas[start:end]
+            )
+        self._bump_write_version()
+        # Journal first: the chunks are in ChromaDB now, so they must be
+        # findable by filename even if a derived index fails below
+        by_file: Dict[str, List[str]] = {}
+        for chunk_id, metadata in zip(chunk_ids, chunk_metadatas):
+            by_file.setdefault(metadata["filename"], []).append(chunk_id)
+        self._append_file_index([{"filename": filename, "add": ids} for filename, ids in by_file.items()])
 
-        self.collection.add(
-            ids=chunk_ids,
-            documents=chunk_texts,
-            embeddings=embeddings,
-            metadatas=chunk_metadatas
-        )
+        self._notify_listeners("add", chunk_ids, embeddings)
 
         print(f"Stored {len(chunk_ids)} chunks in vector database")
         return chunk_ids
 
     def search_similar_chunks(
             self,
-            query_embedding: List[float],
+            query_embedding: Union[np.ndarray, List[float]],
             n_results: int = 5,
             filter_metadata: Optional[Dict] = None
     ) -> Dict:
@@ -135,20 +669,204 @@ class VectorDatabase:
             filter_metadata: Optional metadata filters
 
         Returns:
-            Dictionary with chunk IDs, texts, distances, and metadata
+            Dictionary with chunk IDs, texts, cosine distances, cosine similarities, and metadata
+        """
+        return self.search_similar_chunks_many([query_embedding], n_results, filter_metadata)[0]
+
+    def search_similar_chunks_many(
+            self,
+            query_embeddings: Union[np.ndarray, List[List[float]]],
+            n_results: int = 5,
+            filter_metadata: Optional[Dict] = None
+    ) -> List[Dict]:
+        """
+        Search for similar chunks for several query embeddings in one query call.
+
+        Args:
+            query_embeddings: (N, dim) query embeddings
+            n_results: Number of results to return per query
+            filter_metadata: Optional metadata filters
+
+        Returns:
+            One dictionary per query with chunk IDs, texts, cosine distances, cosine similarities, and metadata
         """
+        if filter_metadata:
+            # Selective filters: resolve the matching chunks first and score
+            # them directly instead of walking the HNSW graph for survivors
+            matching = self.collection.get(where=filter_metadata, include=[])["ids"]
+            if len(matching) < self.PREFILTER_MAX_CHUNKS:
+                return self._search_chunk_subset(query_embeddings, matching, n_results)
+
+        elif self.backend == "faiss_ivfpq":
+            # Local reference: a write listener or another worker's write may drop self._ann_index meanwhile
+            index = self._get_ann_index()
+            if index is not None:
+                return self._search_ann(index, query_embeddings, n_results)
+
+        if len(query_embeddings) > self.QUERY_GROUP_SIZE:
+            # HNSW traversals are independent per query and run in native code,
+            # so groups of queries are searched concurrently; map keeps their order
+            groups = [
+                query_embeddings[start:start + self.QUERY_GROUP_SIZE]
+                for start in range(0, len(query_embeddings), self.QUERY_GROUP_SIZE)
+            ]
+            return [
+                result
+                for group_results in self._get_query_pool().map(
+                    lambda group: self._query_collection(group, n_results, filter_metadata), groups
+                )
+                for result in group_results
+            ]
+
+        return self._query_collection(query_embeddings, n_results, filter_metadata)
+
+    def _get_query_pool(self) -> ThreadPoolExecutor:
+        """Thread pool for grouped queries, created per process on first use (threads do not survive fork)."""
+        with self._query_pool_lock:
+            if self._query_pool is None or self._query_pool_pid != os.getpid():
+                self._query_pool = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 1,
+                    thread_name_prefix="kreps-query"
+                )
+                self._query_pool_pid = os.getpid()
+            return self._query_pool
+
+    def _query_collection(
+            self,
+            query_embeddings: Union[np.ndarray, List[List[float]]],
+            n_results: int,
+            filter_metadata: Optional[Dict]
+    ) -> List[Dict]:
+        """One collection.query call, converted to per-query result dictionaries."""
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=query_embeddings,
             n_results=n_results,
             where=filter_metadata
         )
 
-        return {
-            "ids": results["ids"][0],
-            "documents": results["documents"][0],
-            "distances": results["distances"][0],
-            "metadatas": results["metadatas"][0]
-        }
+        return [
+            {
+                "ids": results["ids"][i],
+                "documents": results["documents"][i],
+                "distances": distances,
+                # The collection uses cosine space (distance = 1 - cosine similarity)
+                "similarities": [1.0 - distance for distance in distances],
+                "metadatas": results["metadatas"][i]
+            }
+            for i, distances in enumerate(results["distances"])
+        ]
+
+    def _get_ann_index(self) -> Optional[VectorIndex]:
+        """Build the FAISS index from the collection once it is large enough."""
+        # Drops an index that missed another worker's writes
+        self._check_foreign_writes()
+        with self._ann_lock:
+            index = self._ann_index
+            if index is not None:
+                return index
+            count = self.collection.count()
+            if count < self.FAISS_MIN_CHUNKS:
+                return None
+
+            # Writes made during the build are not forwarded to the unpublished index
+            build_version = self._write_version
+            print(f"Building FAISS IVF-PQ index over {count} chunks...")
+            index = FaissIVFPQIndex()
+            train_size = min(count, self.FAISS_TRAIN_SIZE)
+            pending_ids: List[str] = []
+            pending: List[np.ndarray] = []
+            offset = 0
+            while True:
+                page = self.collection.get(limit=10_000, offset=offset, include=["embeddings"])
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+                embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+
+                if index.is_trained:
+                    index.add(page["ids"], embeddings)
+                    continue
+
+                # Collect the first train_size vectors, train on them, then add them
+                pending_ids.extend(page["ids"])
+                pending.append(embeddings)
+                if len(pending_ids) >= train_size:
+                    sample = np.concatenate(pending)
+                    index.train(sample)
+                    index.add(pending_ids, sample)
+                    pending_ids, pending = [], []
+
+            if not index.is_trained:
+                return None
+
+            # Published under the version lock, so a write either bumped the
+            # version before this check or is notified to the published index
+            with self._version_lock:
+                if self._write_version != build_version:
+                    print("Collection changed while building the FAISS index; rebuilding on a later query")
+                    return None
+                self._ann_index = index
+            return index
+
+    def _search_ann(self, index: VectorIndex, query_embeddings, n_results: int) -> List[Dict]:
+        """Search the FAISS index and fetch the hits' documents and metadata in one get."""
+        scores, hit_ids = index.query(query_embeddings, n_results)
+
+        wanted = list(dict.fromkeys(chunk_id for row in hit_ids for chunk_id in row))
+        data = self.collection.get(ids=wanted, include=["documents", "metadatas"]) if wanted else {"ids": []}
+        position = {chunk_id: i for i, chunk_id in enumerate(data["ids"])}
+
+        results = []
+        for row_ids, row_scores in zip(hit_ids, scores.tolist()):
+            hits = [(chunk_id, score) for chunk_id, score in zip(row_ids, row_scores) if chunk_id in position]
+            results.append({
+                "ids": [chunk_id for chunk_id, _ in hits],
+                "documents": [data["documents"][position[chunk_id]] for chunk_id, _ in hits],
+                "distances": [1.0 - score for _, score in hits],
+                "similarities": [score for _, score in hits],
+                "metadatas": [data["metadatas"][position[chunk_id]] for chunk_id, _ in hits]
+            })
+        return results
+
+    def _search_chunk_subset(
+            self,
+            query_embeddings: Union[np.ndarray, List[List[float]]],
+            chunk_ids: List[str],
+            n_results: int
+    ) -> List[Dict]:
+        """Exact cosine search over a small set of chunks, in the same format as search_similar_chunks_many."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries.reshape(len(queries), -1)
+        data = self.collection.get(ids=chunk_ids, include=["embeddings", "documents", "metadatas"]) if chunk_ids else None
+
+        n = min(n_results, len(chunk_ids))
+        if n == 0:
+            return [
+                {"ids": [], "documents": [], "distances": [], "similarities": [], "metadatas": []}
+                for _ in range(len(queries))
+            ]
+
+        matrix = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+        # Not in place: the arrays may be read-only or shared with the caller
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ matrix.T
+
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+
+        results = []
+        for row, row_scores in zip(top.tolist(), np.take_along_axis(top_scores, order, axis=1).tolist()):
+            results.append({
+                "ids": [data["ids"][i] for i in row],
+                "documents": [data["documents"][i] for i in row],
+                "distances": [1.0 - score for score in row_scores],
+                "similarities": row_scores,
+                "metadatas": [data["metadatas"][i] for i in row]
+            })
+        return results
 
     def get_chunks_by_ids(self, chunk_ids: List[str]) -> Dict:
         """
@@ -178,9 +896,11 @@ class VectorDatabase:
         Returns:
             Dictionary with all chunks from that document
         """
-        results = self.collection.get(
-            where={"filename": filename}
-        )
+        chunk_ids = self._document_chunk_ids(filename)
+        if not chunk_ids:
+            return {"ids": [], "documents": [], "metadatas": []}
+
+        results = self.collection.get(ids=chunk_ids)
 
         return {
             "ids": results["ids"],
@@ -191,13 +911,29 @@ class VectorDatabase:
     def delete_chunks(self, chunk_ids: List[str]):
         """Delete specific chunks from the database."""
         self.collection.delete(ids=chunk_ids)
+        self._bump_write_version()
+        self._remove_from_indexes(chunk_ids)
         print(f"Deleted {len(chunk_ids)} chunks")
 
     def delete_document_chunks(self, filename: str):
         """Delete all chunks from a specific document."""
-        self.collection.delete(where={"filename": filename})
+        chunk_ids = self._document_chunk_ids(filename)
+        if chunk_ids:
+            self.collection.delete(ids=chunk_ids)
+        self._bump_write_version()
+        self._append_file_index([{"filename": filename, "drop": True}])
+        self._notify_listeners("remove", chunk_ids)
         print(f"Deleted all chunks from: {filename}")
 
+    def delete_session_chunks(self, session_id: str):
+        """Delete all chunks stored under a session ID, leaving the rest of the collection intact."""
+        chunk_ids = self.collection.get(where={"session_id": session_id}, include=[])["ids"]
+        if chunk_ids:
+            self.collection.delete(ids=chunk_ids)
+        self._bump_write_version()
+        self._remove_from_indexes(chunk_ids)
+        print(f"Deleted all chunks from session: {session_id}")
+
     def update_chunk_metadata(self, chunk_id: str, additional_metadata: Dict):
         """
         Update or add metadata to an existing chunk.
@@ -206,7 +942,7 @@ class VectorDatabase:
             chunk_id: ID of the chunk to update
             additional_metadata: New metadata to add/update
         """
-        current_data = self.collection.get(ids=[chunk_id])
+        current_data = self.collection.get(ids=[chunk_id], include=["metadatas"])
 
         if not current_data['ids']:
             raise ValueError(f"Chunk ID not found: {chunk_id}")
@@ -229,17 +965,19 @@ class VectorDatabase:
             chunk_ids: List of chunk IDs to update
             additional_metadata: Metadata to add to all chunks
         """
-        current_data = self.collection.get(ids=chunk_ids)
+        current_data = self.collection.get(ids=chunk_ids, include=["metadatas"])
 
-        updated_metadatas = []
-        for current_meta in current_data['metadatas']:
-            updated_meta = {**current_meta, **additional_metadata}
-            updated_metadatas.append(updated_meta)
+        updated_metadatas = [
+            {**current_meta, **additional_metadata}
+            for current_meta in current_data['metadatas']
+        ]
 
-        self.collection.update(
-            ids=chunk_ids,
-            metadatas=updated_metadatas
-        )
+        # ChromaDB returns found chunks in its own order, so write back by its IDs
+        if updated_metadatas:
+            self.collection.update(
+                ids=current_data['ids'],
+                metadatas=updated_metadatas
+            )
 
         print(f"Updated metadata for {len(chunk_ids)} chunks")
 
@@ -261,22 +999,67 @@ class VectorDatabase:
             rank: Rank in retrieval results
             retrieval_timestamp: When it was retrieved
         """
-        retrieval_metadata = {
-            "last_query": query,
-            "last_similarity_score": similarity_score,
-            "last_retrieval_rank": rank,
-            "last_retrieval_timestamp": retrieval_timestamp or datetime.now().isoformat(),
-            "retrieval_count": self._increment_retrieval_count(chunk_id)
+        # One read and one write, instead of separate reads for the count and the update
+        updated = self.add_retrieval_metadata_batch(
+            chunk_ids=[chunk_id],
+            query=query,
+            similarity_scores=[similarity_score],
+            ranks=[rank],
+            retrieval_timestamp=retrieval_timestamp
+        )
+        if not updated:
+            raise ValueError(f"Chunk ID not found: {chunk_id}")
+
+    def add_retrieval_metadata_batch(
+            self,
+            chunk_ids: List[str],
+            query: str,
+            similarity_scores: List[float],
+            ranks: List[int],
+            retrieval_timestamp: str = None
+    ) -> int:
+        """
+        Add retrieval metadata for all chunks returned by one query.
+
+        Reads the current metadata once and writes it back with a single
+        update, instead of one read and one write per chunk.
+
+        Args:
+            chunk_ids: Chunks that were retrieved
+            query: User query that retrieved these chunks
+            similarity_scores: Similarity score per chunk
+            ranks: Rank per chunk in the retrieval results
+            retrieval_timestamp: When they were retrieved
+
+        Returns:
+            Number of chunks updated (chunks no longer in the database are skipped)
+        """
+        if not chunk_ids:
+            return 0
+
+        retrieval_timestamp = retrieval_timestamp or datetime.now().isoformat()
+        details = {
+            chunk_id: (score, rank)
+            for chunk_id, score, rank in zip(chunk_ids, similarity_scores, ranks)
         }
 
-        self.update_chunk_metadata(chunk_id, retrieval_metadata)
+        current_data = self.collection.get(ids=chunk_ids, include=["metadatas"])
+
+        updated_metadatas = []
+        for chunk_id, current_meta in zip(current_data['ids'], current_data['metadatas']):
+            score, rank = details[chunk_id]
+            updated_metadatas.append({
+                **current_meta,
+                "last_query": query,
+                "last_similarity_score": score,
+                "last_retrieval_rank": rank,
+                "last_retrieval_timestamp": retrieval_timestamp,
+                "retrieval_count": current_meta.get('retrieval_count', 0) + 1
+            })
 
-    def _increment_retrieval_count(self, chunk_id: str) -> int:
-        """Helper to track how many times a chunk has been retrieved."""
-        current_data = self.collection.get(ids=[chunk_id])
-        current_meta = current_data['metadatas'][0]
-        current_count = current_meta.get('retrieval_count', 0)
-        return current_count + 1
+        if updated_metadatas:
+            self.collection.update(ids=current_data['ids'], metadatas=updated_metadatas)
+        return len(updated_metadatas)
 
     def add_llm_response_metadata(
             self,
@@ -308,12 +1091,10 @@ class VectorDatabase:
         """Get statistics about the vector database."""
         total_chunks = self.collection.count()
 
-        if total_chunks > 0:
-            all_data = self.collection.get()
-            unique_docs = set(meta.get('filename', 'unknown')
-                              for meta in all_data['metadatas'])
-        else:
-            unique_docs = set()
+        # The file index already groups chunk IDs by filename, so no chunk data is read
+        self._sync_file_index()
+        with self._file_index_lock:
+            unique_docs = set(self._file_index) if total_chunks > 0 else set()
 
         return {
             "collection_name": self.collection_name,
@@ -330,6 +1111,13 @@ class VectorDatabase:
             name=self.collection_name,
             metadata={"hnsw:space": "cosine"}
         )
+        self._bump_write_version()
+        with self._chunk_counter_lock:
+            self._chunk_counter = 0
+        self._ann_index = None
+        if self.vector_file is not None:
+            self.vector_file.clear()
+        self._rewrite_file_index({})
         print(f"Database '{self.collection_name}' has been reset")
 
     def export_metadata_to_json(self, output_path: str = "database_metadata.json"):